@@ -0,0 +1,199 @@
+import os
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+
+import metrics
+
+# Runs streaming at once, in the whole process and per user.
+ADMISSION_GLOBAL_LIMIT = int(os.environ.get("ADMISSION_GLOBAL_LIMIT", 32))
+ADMISSION_PER_USER_LIMIT = int(os.environ.get("ADMISSION_PER_USER_LIMIT", 4))
+# OpenAI tokens per minute the process may spend; 0 disables the token bucket.
+ADMISSION_TOKENS_PER_MINUTE = int(os.environ.get("ADMISSION_TOKENS_PER_MINUTE", 0))
+# Beyond these, a turn is turned away instead of queued.
+ADMISSION_MAX_QUEUE = int(os.environ.get("ADMISSION_MAX_QUEUE", 500))
+ADMISSION_MAX_WAIT = float(os.environ.get("ADMISSION_MAX_WAIT", 120))
+# How long admissions stop after OpenAI answers with a 429.
+ADMISSION_RATE_LIMIT_PAUSE = float(os.environ.get("ADMISSION_RATE_LIMIT_PAUSE", 10))
+ADMISSION_POLL_INTERVAL = 0.5
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, reason):
+        super().__init__(reason)
+        self.reason = reason
+
+
+class _Ticket:
+    def __init__(self, user):
+        self.user = user
+        self.admitted = False
+
+
+class Slot:
+    """An admitted run; charge() records the tokens it actually used."""
+
+    def __init__(self, controller):
+        self._controller = controller
+
+    def charge(self, tokens):
+        self._controller._charge(tokens)
+
+
+class AdmissionController:
+    """Process-wide gate in front of assistant runs.
+
+    Waiting turns are admitted in arrival order, skipping users who are
+    already at their own limit, while the global limit allows it and the
+    token bucket is not in debt. The bucket refills at tokens_per_minute and
+    is charged with each run's actual usage once the run is done.
+    """
+
+    def __init__(
+        self,
+        global_limit=ADMISSION_GLOBAL_LIMIT,
+        per_user_limit=ADMISSION_PER_USER_LIMIT,
+        tokens_per_minute=ADMISSION_TOKENS_PER_MINUTE,
+        max_queue=ADMISSION_MAX_QUEUE,
+        max_wait=ADMISSION_MAX_WAIT,
+    ):
+        self.global_limit = global_limit
+        self.per_user_limit = per_user_limit
+        self.tokens_per_minute = tokens_per_minute
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self._cond = threading.Condition()
+        self._waiting = deque()
+        self._active = 0
+        self._active_by_user = Counter()
+        self._tokens = float(tokens_per_minute)
+        self._refilled_at = time.monotonic()
+        self._paused_until = 0.0
+
+    @contextmanager
+    def admit(self, user, on_wait=None, cancelled=None):
+        """Hold a run slot for user, calling on_wait(position) while queued.
+
+        Leaves the queue with AdmissionRejected("cancelled") once cancelled() is true.
+        """
+        ticket = self._enqueue(user)
+        started = time.monotonic()
+        try:
+            self._wait(ticket, started, on_wait, cancelled)
+        except BaseException:
+            with self._cond:
+                if ticket.admitted:
+                    self._release(ticket)
+                else:
+                    self._waiting.remove(ticket)
+                    self._admit_waiting()
+            raise
+        metrics.observe("admission_wait_seconds", time.monotonic() - started)
+        try:
+            yield Slot(self)
+        finally:
+            with self._cond:
+                self._release(ticket)
+
+    def pause(self, seconds=ADMISSION_RATE_LIMIT_PAUSE):
+        """Stop admitting new runs for a while, e.g. after a 429 from OpenAI."""
+        with self._cond:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        metrics.incr("admission_pauses_total")
+
+    def _enqueue(self, user):
+        with self._cond:
+            if len(self._waiting) >= self.max_queue:
+                metrics.incr("admission_rejections_total", reason="queue_full")
+                raise AdmissionRejected("queue_full")
+            ticket = _Ticket(user)
+            self._waiting.append(ticket)
+            self._admit_waiting()
+            self._report()
+            return ticket
+
+    def _wait(self, ticket, started, on_wait, cancelled):
+        reported = None
+        while True:
+            with self._cond:
+                if not ticket.admitted:
+                    self._admit_waiting()
+                if ticket.admitted:
+                    return
+                if cancelled is not None and cancelled():
+                    metrics.incr("admission_rejections_total", reason="cancelled")
+                    raise AdmissionRejected("cancelled")
+                if time.monotonic() - started >= self.max_wait:
+                    metrics.incr("admission_rejections_total", reason="timeout")
+                    raise AdmissionRejected("timeout")
+                position = self._waiting.index(ticket) + 1
+                if on_wait is None or position == reported:
+                    self._cond.wait(ADMISSION_POLL_INTERVAL)
+                    continue
+            # Called outside the lock; it may render to the page.
+            on_wait(position)
+            reported = position
+
+    def _admit_waiting(self):
+        # Caller holds self._cond.
+        now = time.monotonic()
+        if now < self._paused_until:
+            return
+        if self.tokens_per_minute:
+            elapsed = now - self._refilled_at
+            self._tokens = min(
+                self.tokens_per_minute, self._tokens + elapsed * self.tokens_per_minute / 60
+            )
+            self._refilled_at = now
+        admitted = False
+        for ticket in list(self._waiting):
+            if self._active >= self.global_limit:
+                break
+            if self.tokens_per_minute and self._tokens <= 0:
+                break
+            if self._active_by_user[ticket.user] >= self.per_user_limit:
+                continue
+            self._waiting.remove(ticket)
+            ticket.admitted = True
+            self._active += 1
+            self._active_by_user[ticket.user] += 1
+            admitted = True
+        if admitted:
+            self._cond.notify_all()
+            self._report()
+
+    def _release(self, ticket):
+        # Caller holds self._cond.
+        self._active -= 1
+        self._active_by_user[ticket.user] -= 1
+        if not self._active_by_user[ticket.user]:
+            del self._active_by_user[ticket.user]
+        self._admit_waiting()
+        self._cond.notify_all()
+        self._report()
+
+    def _charge(self, tokens):
+        if not self.tokens_per_minute or not tokens:
+            return
+        with self._cond:
+            self._tokens -= tokens
+        metrics.incr("admission_tokens_charged_total", tokens)
+
+    def _report(self):
+        metrics.gauge("admission_active", self._active)
+        metrics.gauge("admission_queue_depth", len(self._waiting))
+        if self.tokens_per_minute:
+            metrics.gauge("admission_tokens_available", self._tokens)
+
+
+_controller = None
+_controller_lock = threading.Lock()
+
+
+def get_controller():
+    global _controller
+    with _controller_lock:
+        if _controller is None:
+            _controller = AdmissionController()
+        return _controller
@@ -0,0 +1,156 @@
+import os
+import threading
+import time
+
+import metrics
+from settings import CACHE_DIR, connect_sqlite
+from cache import TTLCache
+
+CHAT_STORE_PATH = os.environ.get(
+    "CHAT_STORE_PATH", os.path.join(CACHE_DIR, "chat_store.sqlite3")
+)
+# Bytes of chat messages a session may keep in memory before older turns spill.
+CHAT_SESSION_MEMORY_BUDGET = int(os.environ.get("CHAT_SESSION_MEMORY_BUDGET", 256 * 1024))
+# Messages per page that always stay in memory, whatever their size.
+CHAT_MIN_MEMORY_MESSAGES = int(os.environ.get("CHAT_MIN_MEMORY_MESSAGES", 2))
+# Spilled sessions untouched for this long are removed from the store.
+CHAT_STORE_TTL = float(os.environ.get("CHAT_STORE_TTL", 24 * 3600))
+# A session that has not reported its memory use for this long (it ended
+# without logging out) no longer counts towards the chat_memory gauges.
+CHAT_MEMORY_TTL = float(os.environ.get("CHAT_MEMORY_TTL", 3600))
+
+
+def message_size(chat):
+    return len(chat["name"].encode()) + len(chat["msg"].encode())
+
+
+class ChatStore:
+    """Spilled chat messages, keyed by (session_id, page) and position in the page log."""
+
+    def __init__(self, path=CHAT_STORE_PATH):
+        self._lock = threading.Lock()
+        self._conn = connect_sqlite(path)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS messages ("
+            "session_id TEXT NOT NULL, "
+            "page TEXT NOT NULL, "
+            "seq INTEGER NOT NULL, "
+            "name TEXT NOT NULL, "
+            "msg TEXT NOT NULL, "
+            "size INTEGER NOT NULL, "
+            "stored_at REAL NOT NULL, "
+            "PRIMARY KEY (session_id, page, seq))"
+        )
+        self._conn.execute(
+            "DELETE FROM messages WHERE session_id IN ("
+            "SELECT session_id FROM messages GROUP BY session_id HAVING MAX(stored_at) < ?)",
+            (time.time() - CHAT_STORE_TTL,),
+        )
+        self._conn.commit()
+
+    def spill(self, session_id, page, start, chats):
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO messages VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (session_id, page, start + offset, chat["name"], chat["msg"], message_size(chat), now)
+                    for offset, chat in enumerate(chats)
+                ],
+            )
+            self._conn.commit()
+
+    def load(self, session_id, page, start, stop):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT name, msg FROM messages "
+                "WHERE session_id = ? AND page = ? AND seq >= ? AND seq < ? ORDER BY seq",
+                (session_id, page, start, stop),
+            ).fetchall()
+        return [{"name": name, "msg": msg} for name, msg in rows]
+
+    def session_bytes(self, session_id):
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM messages WHERE session_id = ?",
+                (session_id,),
+            ).fetchone()[0]
+
+    def total_bytes(self):
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM messages"
+            ).fetchone()[0]
+
+    def drop(self, session_id, page=None):
+        with self._lock:
+            if page is None:
+                self._conn.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+            else:
+                self._conn.execute(
+                    "DELETE FROM messages WHERE session_id = ? AND page = ?", (session_id, page)
+                )
+            self._conn.commit()
+
+
+_store = None
+_store_lock = threading.Lock()
+# session_id -> bytes of chat messages that session holds in memory
+_memory_bytes = TTLCache(maxsize=100000, ttl=CHAT_MEMORY_TTL)
+
+
+def get_store():
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = ChatStore()
+        return _store
+
+
+def report_memory(session_id, size):
+    if size:
+        _memory_bytes.set(session_id, size)
+    else:
+        _memory_bytes.pop(session_id)
+    sizes = _memory_bytes.values()
+    metrics.gauge("chat_memory_bytes", sum(sizes))
+    metrics.gauge("chat_memory_sessions", len(sizes))
+
+
+def enforce_budget(session_id, page_chat_logs, spilled_counts, budget=CHAT_SESSION_MEMORY_BUDGET):
+    """Move the oldest in-memory messages to the store until the session fits its budget.
+
+    page_chat_logs holds the in-memory tail of each page's log and
+    spilled_counts how many messages before that tail were spilled; both are
+    updated in place. Returns the bytes still held in memory.
+    """
+    sizes = {
+        page: sum(message_size(chat) for chat in chats)
+        for page, chats in page_chat_logs.items()
+    }
+    used = sum(sizes.values())
+    while used > budget:
+        # Take from the heaviest page that still has something to give up.
+        candidates = [
+            page for page, chats in page_chat_logs.items()
+            if len(chats) > CHAT_MIN_MEMORY_MESSAGES
+        ]
+        if not candidates:
+            break
+        page = max(candidates, key=sizes.get)
+        chats = page_chat_logs[page]
+        spill = []
+        spilled_bytes = 0
+        while len(chats) - len(spill) > CHAT_MIN_MEMORY_MESSAGES and used - spilled_bytes > budget:
+            chat = chats[len(spill)]
+            spill.append(chat)
+            spilled_bytes += message_size(chat)
+        start = spilled_counts.get(page, 0)
+        get_store().spill(session_id, page, start, spill)
+        del chats[:len(spill)]
+        spilled_counts[page] = start + len(spill)
+        sizes[page] -= spilled_bytes
+        used -= spilled_bytes
+        metrics.incr("chat_messages_spilled_total", len(spill))
+    report_memory(session_id, used)
+    return used
@@ -0,0 +1,67 @@
+import json
+import os
+
+import metrics
+
+# "off", "truncate" (send only the last messages to the model) or "summary"
+# (continue on a new thread seeded with a summary of the old one).
+COMPACTION_MODE = os.environ.get("COMPACTION_MODE", "off").lower()
+# Per page overrides, e.g. {"Project Crafting": "summary"}.
+COMPACTION_PAGE_MODES = json.loads(os.environ.get("COMPACTION_PAGE_MODES", "{}"))
+# Compaction starts once a run on the thread used more prompt tokens than this.
+COMPACTION_PROMPT_TOKENS = int(os.environ.get("COMPACTION_PROMPT_TOKENS", 8000))
+COMPACTION_LAST_MESSAGES = int(os.environ.get("COMPACTION_LAST_MESSAGES", 20))
+COMPACTION_KEEP_MESSAGES = int(os.environ.get("COMPACTION_KEEP_MESSAGES", 4))
+COMPACTION_SUMMARY_MODEL = os.environ.get("COMPACTION_SUMMARY_MODEL", "gpt-4o-mini")
+
+SUMMARY_PROMPT = (
+    "Ringkas percakapan coaching karier berikut untuk dilanjutkan oleh coach yang sama. "
+    "Pertahankan semua fakta tentang siswa (nama, pengalaman, nilai, tujuan, proyek), "
+    "keputusan yang sudah diambil, draf terakhir yang disepakati, dan langkah berikutnya "
+    "dalam alur coaching. Tulis dalam bahasa percakapan aslinya."
+)
+
+
+def page_mode(page):
+    return COMPACTION_PAGE_MODES.get(page, COMPACTION_MODE).lower()
+
+
+def needs_compaction(mode, prompt_tokens):
+    return mode in ("truncate", "summary") and (prompt_tokens or 0) > COMPACTION_PROMPT_TOKENS
+
+
+def truncation_strategy():
+    return {"type": "last_messages", "last_messages": COMPACTION_LAST_MESSAGES}
+
+
+def _message_text(message):
+    return "\n".join(part.text.value for part in message.content if part.type == "text")
+
+
+def summary_messages(client, thread_id):
+    """Messages seeding a new thread: a summary of thread_id plus its last few messages.
+
+    The caller creates the thread (with the student's tool_resources); the
+    old thread is left as it is.
+    """
+    metrics.count_api_call("openai", "messages.list")
+    messages = [
+        message
+        for message in client.beta.threads.messages.list(thread_id=thread_id, order="asc", limit=100)
+        if _message_text(message)
+    ]
+    transcript = "\n\n".join(f"{message.role}: {_message_text(message)}" for message in messages)
+    metrics.count_api_call("openai", "chat.completions.create")
+    completion = client.chat.completions.create(
+        model=COMPACTION_SUMMARY_MODEL,
+        messages=[
+            {"role": "system", "content": SUMMARY_PROMPT},
+            {"role": "user", "content": transcript},
+        ],
+    )
+    summary = completion.choices[0].message.content
+    recent = messages[-COMPACTION_KEEP_MESSAGES:] if COMPACTION_KEEP_MESSAGES else []
+    return [
+        {"role": "assistant", "content": f"Ringkasan percakapan sebelumnya:\n\n{summary}"},
+        *({"role": message.role, "content": _message_text(message)} for message in recent),
+    ]
@@ -0,0 +1,1233 @@
+"""Shared app logic for Home.py and the pages in pages_section/.
+
+Importing this module only reads configuration; the OpenAI client and the
+Airtable API are created on first use, so page scripts can import it cheaply.
+"""
+import os
+import hashlib
+import html
+import json
+import re
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import streamlit as st
+import openai
+from openai import AssistantEventHandler
+from openai.types.beta.threads import Run
+from typing_extensions import override
+
+# First: loads .env, which the modules below read their settings from.
+import settings  # noqa: F401
+from tools import run_tool_calls
+from streaming import StreamRenderer
+import history
+import users
+import metrics
+import uploads
+import extraction
+import file_links
+import chat_store
+import admission
+import compaction
+import response_cache
+import run_workers
+import session_store
+import transport
+import vector_stores
+
+BASE_ID = os.environ.get('BASE_ID')
+USER_TABLE_NAME = 'Users'
+CHAT_TABLE_NAME = 'Chat History'
+AIRTABLE_API_KEY = os.environ.get('AIRTABLE_API_KEY')
+AIRTABLE_ENDPOINT_URL = os.environ.get('AIRTABLE_ENDPOINT_URL', 'https://api.airtable.com')
+
+
+def str_to_bool(str_input):
+    if not isinstance(str_input, str):
+        return False
+    return str_input.lower() == "true"
+
+# Load environment variables
+openai_api_key = os.environ.get("OPENAI_API_KEY")
+instructions = os.environ.get("RUN_INSTRUCTIONS", "")
+enabled_file_upload_message = os.environ.get(
+    "ENABLED_FILE_UPLOAD_MESSAGE", "Upload a file"
+)
+azure_openai_endpoint = os.environ.get("AZURE_OPENAI_ENDPOINT")
+azure_openai_key = os.environ.get("AZURE_OPENAI_KEY")
+authentication_required = str_to_bool(os.environ.get("AUTHENTICATION_REQUIRED", False))
+busy_message = os.environ.get(
+    "BUSY_MESSAGE",
+    "Maaf, asisten sedang melayani banyak pengguna. Silakan kirim ulang pesanmu sebentar lagi.",
+)
+# URL query parameter carrying the session token when a session store is configured
+session_query_param = os.environ.get("SESSION_QUERY_PARAM", "s")
+# HttpOnly cookie set by the load balancer (deploy/nginx.conf). A stored session
+# is only restored for the browser holding it, so the URL token alone is not a login.
+session_cookie = os.environ.get("SESSION_COOKIE", "stlb")
+# How often a page following a run checks in while no new text arrives
+run_poll_interval = float(os.environ.get("RUN_POLL_INTERVAL", 0.5))
+# Turns of chat history rendered by default, and added per "show older" click
+chat_window_turns = int(os.environ.get("CHAT_WINDOW_TURNS", 10))
+chat_window_page_turns = int(os.environ.get("CHAT_WINDOW_PAGE_TURNS", 10))
+
+_client = None
+_airtable = None
+_clients_lock = threading.Lock()
+
+
+def get_client():
+    global _client
+    with _clients_lock:
+        if _client is None:
+            if azure_openai_endpoint and azure_openai_key:
+                _client = openai.AzureOpenAI(
+                    api_key=azure_openai_key,
+                    api_version="2024-05-01-preview",
+                    azure_endpoint=azure_openai_endpoint,
+                    http_client=transport.openai_http_client(),
+                    max_retries=transport.OPENAI_MAX_RETRIES,
+                )
+            else:
+                _client = openai.OpenAI(
+                    api_key=openai_api_key,
+                    http_client=transport.openai_http_client(),
+                    max_retries=transport.OPENAI_MAX_RETRIES,
+                )
+        return _client
+
+
+def get_airtable():
+    global _airtable
+    with _clients_lock:
+        if _airtable is None:
+            _airtable = transport.airtable_api(AIRTABLE_API_KEY, AIRTABLE_ENDPOINT_URL)
+        return _airtable
+
+
+def init_session_state():
+    if "tool_call" not in st.session_state:
+        st.session_state.tool_calls = []
+    if "chat_log" not in st.session_state:
+        st.session_state.chat_log = []
+    if "in_progress" not in st.session_state:
+        st.session_state.in_progress = False
+
+
+def session_binding():
+    # Hash of the browser's session cookie, or None when the request has none.
+    value = st.context.cookies.get(session_cookie)
+    return hashlib.sha256(value.encode()).hexdigest() if value else None
+
+
+def restore_session():
+    # With a shared session store, the token in the page URL lets any replica
+    # (or this one after a restart) continue the student's session, but only
+    # in the browser that holds the session cookie it was bound to.
+    if session_store.get_store() is None:
+        return
+    token = st.session_state.get('session_token')
+    if token is None:
+        binding = session_binding()
+        if binding is None:
+            # Not behind the load balancer: keep the session in this process only.
+            metrics.incr("sessions_unbound_total")
+            return
+        token = st.query_params.get(session_query_param)
+        state = None
+        if token:
+            try:
+                state = session_store.load_state(token)
+            except (OSError, sqlite3.Error, session_store.RedisError):
+                metrics.incr("session_store_errors_total", operation="load")
+        if state and state.get('session_binding') == binding:
+            st.session_state.update(state)
+            metrics.incr("sessions_restored_total")
+        else:
+            if state:
+                metrics.incr("sessions_rejected_total")
+            token = new_session_token()
+        st.session_state['session_token'] = token
+    # Page navigation drops query parameters, so put it back on every run.
+    if st.query_params.get(session_query_param) != token:
+        st.query_params[session_query_param] = token
+
+
+def new_session_token():
+    token = uuid.uuid4().hex
+    st.session_state['session_token'] = token
+    st.session_state['session_binding'] = session_binding()
+    st.session_state.pop('session_saved_digest', None)
+    return token
+
+
+def end_stored_session(rotate):
+    # Drops the stored state of the current token, so a copied link or the
+    # browser history cannot bring it back; rotate issues a fresh token.
+    token = st.session_state.pop('session_token', None)
+    if token is None:
+        return
+    try:
+        session_store.delete_state(token)
+    except (OSError, sqlite3.Error, session_store.RedisError):
+        metrics.incr("session_store_errors_total", operation="delete")
+    if rotate:
+        st.query_params[session_query_param] = new_session_token()
+    else:
+        st.session_state.pop('session_binding', None)
+        st.session_state.pop('session_saved_digest', None)
+        st.query_params.pop(session_query_param, None)
+
+
+def persist_session():
+    token = st.session_state.get('session_token')
+    if token is None or session_store.get_store() is None:
+        return
+    data = session_store.dumps(st.session_state)
+    digest = hashlib.sha256(data.encode()).hexdigest()
+    if digest == st.session_state.get('session_saved_digest'):
+        return
+    try:
+        session_store.save_state(token, data)
+    except (OSError, sqlite3.Error, session_store.RedisError):
+        metrics.incr("session_store_errors_total", operation="save")
+        return
+    st.session_state['session_saved_digest'] = digest
+
+
+class RunEventHandler(AssistantEventHandler):
+    # Collects the run and reply text without touching the UI, so it can also
+    # be used from worker threads that have no Streamlit script context.
+    def __init__(self, thread_id):
+        super().__init__()
+        self.run_id = None
+        self.thread_id = thread_id
+        self.run = None
+        self.final_text = None
+        self.first_token_at = None
+
+    @override
+    def on_event(self, event):
+        if event.event == "thread.message.delta" and self.first_token_at is None:
+            self.first_token_at = time.monotonic()
+        # thread.run.* events carry the Run itself; the completed one has usage.
+        if event.event.startswith("thread.run.") and not event.event.startswith("thread.run.step."):
+            self.run = event.data
+            self.run_id = event.data.id
+        if event.event == "thread.run.requires_action":
+            self.submit_tool_outputs(event.data)
+
+    def submit_tool_outputs(self, run):
+        # All function calls of the step run concurrently; the run continues
+        # on a new stream whose handler results are carried back to this one.
+        tool_outputs = run_tool_calls(run.required_action.submit_tool_outputs.tool_calls)
+        child = self.child_handler()
+        metrics.count_api_call("openai", "runs.submit_tool_outputs_stream")
+        with get_client().beta.threads.runs.submit_tool_outputs_stream(
+            thread_id=self.thread_id,
+            run_id=run.id,
+            tool_outputs=tool_outputs,
+            event_handler=child,
+        ) as stream:
+            stream.until_done()
+        self.run = child.run
+        self.run_id = child.run_id
+        if self.first_token_at is None:
+            self.first_token_at = child.first_token_at
+        if child.final_text is not None:
+            self.final_text = child.final_text
+
+    def child_handler(self):
+        return type(self)(self.thread_id)
+
+    @override
+    def on_message_done(self, message):
+        if message.content and message.content[0].type == "text":
+            self.final_text = message.content[0].text.value
+
+
+class EventHandler(RunEventHandler):
+    # Runs on a run_workers thread; the page renders what it writes to the
+    # buffer (see attach_run), so the reply outlives the script run.
+    def __init__(self, thread_id, buffer):
+        super().__init__(thread_id)
+        self.buffer = buffer
+        self.partial_text = ""
+
+    def child_handler(self):
+        return type(self)(self.thread_id, self.buffer)
+
+    @override
+    def on_event(self, event):
+        if event.event == "thread.run.created":
+            # Stop, idle timeout and logout cancel the run through the buffer.
+            self.buffer.on_cancel(lambda: cancel_openai_run(self.thread_id, event.data.id))
+        super().on_event(event)
+        if self.buffer.past_cancel_grace():
+            raise run_workers.RunCancelled()
+
+    def submit_tool_outputs(self, run):
+        # A cancelled run no longer accepts tool outputs.
+        if self.buffer.cancel_reason is None:
+            super().submit_tool_outputs(run)
+
+    @override
+    def on_text_delta(self, delta, snapshot):
+        if delta.value:
+            self.partial_text += delta.value
+            self.buffer.append("delta", delta.value)
+
+    @override
+    def on_text_done(self, text):
+        started = time.monotonic()
+        format_text = format_annotation(text)
+        metrics.observe("annotation_format_seconds", time.monotonic() - started, page=self.buffer.page)
+        self.buffer.append("message", format_text)
+
+    # @override
+    # def on_tool_call_created(self, tool_call):
+    #     if tool_call.type == "code_interpreter":
+    #         st.session_state.current_tool_input = ""
+    #         with st.chat_message("Assistant"):
+    #             st.session_state.current_tool_input_markdown = st.empty()
+
+    # @override
+    # def on_tool_call_delta(self, delta, snapshot):
+    #     if 'current_tool_input_markdown' not in st.session_state:
+    #         with st.chat_message("Assistant"):
+    #             st.session_state.current_tool_input_markdown = st.empty()
+
+    #     if delta.type == "code_interpreter":
+    #         if delta.code_interpreter.input:
+    #             st.session_state.current_tool_input += delta.code_interpreter.input
+    #             input_code = f"### code interpreter\ninput:\n```python\n{st.session_state.current_tool_input}\n```"
+    #             st.session_state.current_tool_input_markdown.markdown(input_code, True)
+
+    #         if delta.code_interpreter.outputs:
+    #             for output in delta.code_interpreter.outputs:
+    #                 if output.type == "logs":
+    #                     pass
+
+    # @override
+    # def on_tool_call_done(self, tool_call):
+    #     st.session_state.tool_calls.append(tool_call)
+    #     if tool_call.type == "code_interpreter":
+    #         if tool_call.id in [x.id for x in st.session_state.tool_calls]:
+    #             return
+    #         input_code = f"### code interpreter\ninput:\n```python\n{tool_call.code_interpreter.input}\n```"
+    #         st.session_state.current_tool_input_markdown.markdown(input_code, True)
+    #         st.session_state.chat_log.append({"name": "assistant", "msg": input_code})
+    #         st.session_state.current_tool_input_markdown = None
+    #         for output in tool_call.code_interpreter.outputs:
+    #             if output.type == "logs":
+    #                 output = f"### code interpreter\noutput:\n```\n{output.logs}\n```"
+    #                 with st.chat_message("Assistant"):
+    #                     st.markdown(output, True)
+    #                     st.session_state.chat_log.append(
+    #                         {"name": "assistant", "msg": output}
+    #                     )
+
+def generate_session_id():
+    return str(uuid.uuid4())
+
+def get_user_directory():
+    return users.get_directory(lambda: get_airtable().table(BASE_ID, USER_TABLE_NAME))
+
+def get_user(username, fresh=False):
+    # fresh skips the cached index; logins use it so a changed or revoked
+    # password takes effect at once.
+    try:
+        directory = get_user_directory()
+        return directory.refresh(username) if fresh else directory.get(username)
+    except Exception as e:
+        st.error(f"Error getting user: {str(e)}")
+        return None
+
+def get_student_id(username):
+    user = get_user(username)
+    if user:
+        return user['fields'].get('StudentID')
+    return None
+
+def verify_password(stored_password, provided_password):
+    return stored_password == provided_password
+
+def get_history_store():
+    return history.get_store(lambda: get_airtable().table(BASE_ID, CHAT_TABLE_NAME))
+
+def save_chat_history(session_id, username, student_id, user_input, response, assistant_id, model, prompt_tokens, completion_tokens, total_tokens, cached=False, on_error=None):
+    # Airtable records are spooled locally and written in batches by a
+    # background worker, so the turn never waits on (or fails with) Airtable.
+    # Off the script thread st.error shows nothing, so workers pass on_error.
+    try:
+        fields = {
+            "SessionID": session_id,
+            "Timestamp": int(time.time()),
+            "StudentID": student_id,
+            "Username": username,
+            "UserInput": user_input,
+            "Response": response,
+            "AssistantID" : assistant_id,
+            "Model": model,
+            "PromptTokens": prompt_tokens,
+            "CompletionTokens": completion_tokens,
+            "TotalTokens": total_tokens
+        }
+        if cached:
+            # Only reaches Airtable with HISTORY_CACHED_FIELD (see history.py).
+            fields["Cached"] = True
+        get_history_store().save(fields)
+    except Exception as e:
+        (on_error or st.error)(f"Error saving chat history: {str(e)}")
+
+
+def create_thread(current_page):
+    # Threads are created on the first message of a page, never on page view.
+    if current_page not in st.session_state.page_thread_ids:
+        thread = new_thread(get_session_student_id())
+        st.session_state.page_thread_ids[current_page] = thread.id
+    thread_id = st.session_state.page_thread_ids[current_page]
+    used_thread_ids = st.session_state.setdefault('used_thread_ids', set())
+    if thread_id not in used_thread_ids:
+        used_thread_ids.add(thread_id)
+        metrics.incr("threads_used_total")
+    return thread_id
+
+
+def new_thread(student_id, messages=None):
+    # Threads search the student's vector store from the start, so files they
+    # uploaded on other pages are there without being indexed again.
+    client = get_client()
+    options = {"messages": messages} if messages else {}
+    try:
+        vector_store_id = vector_stores.student_store(client, student_id)
+    except openai.APIError:
+        metrics.incr("vector_store_errors_total")
+        vector_store_id = None
+    metrics.count_api_call("openai", "threads.create")
+    if vector_store_id is None:
+        thread = client.beta.threads.create(**options)
+    else:
+        thread = client.beta.threads.create(
+            tool_resources=vector_stores.tool_resources(vector_store_id), **options
+        )
+        vector_stores.mark_linked(thread.id, vector_store_id)
+    metrics.incr("threads_created_total")
+    return thread
+
+
+def search_tools(thread_id, file, student_id):
+    # A file in the student's vector store is searched through the thread's
+    # tool_resources; anything else falls back to a file_search attachment,
+    # which OpenAI indexes into a vector store of the thread's own.
+    try:
+        vector_store_id = vector_stores.add_file(get_client(), student_id, file)
+        if vector_store_id is not None:
+            vector_stores.link_thread(get_client(), thread_id, vector_store_id)
+            return []
+    except openai.APIError:
+        metrics.incr("vector_store_errors_total")
+    return [{"type": "file_search"}]
+
+
+def create_message(thread_id, content, file, student_id=None):
+    attachments = []
+    if file is not None:
+        attachments.append(
+            {"file_id": file.id, "tools": [{"type": "code_interpreter"}, *search_tools(thread_id, file, student_id)]}
+        )
+    metrics.count_api_call("openai", "messages.create")
+    get_client().beta.threads.messages.create(
+        thread_id=thread_id, role="user", content=content, attachments=attachments
+    )
+
+
+def prepare_upload(user_input, uploaded_file, owner, inlined=None):
+    # Returns (message content, OpenAI file or None). Small text documents are
+    # sent inline so the run does not wait for vector store indexing; inlined
+    # holds the content hashes already inlined on the thread, so a file left in
+    # the sidebar is not repeated on every turn.
+    if uploaded_file is None:
+        return user_input, None
+    sha256 = uploads.content_hash(uploaded_file)
+    if inlined is not None and sha256 in inlined:
+        return user_input, None
+    text = extraction.extract_text(uploaded_file)
+    if text is None:
+        return user_input, uploads.upload_file(get_client(), uploaded_file, owner, sha256)
+    if inlined is not None:
+        inlined.add(sha256)
+    return extraction.inline_content(user_input, uploaded_file.name, text), None
+
+
+def create_file_link(file_name, file_id):
+    # Generated files are streamed to the static folder and linked, not inlined
+    # as data URIs, so chat logs and rerun payloads stay small.
+    href = file_links.generated_file_url(get_client(), file_name, file_id)
+    link_tag = f'<a href="{href}" download="{html.escape(file_name)}">Download Link</a>'
+    return link_tag
+
+
+def format_annotation(text):
+    citations = []
+    text_value = text.value
+    for index, annotation in enumerate(text.annotations):
+        text_value = text.value.replace(annotation.text, f" [{index}]")
+
+        if file_citation := getattr(annotation, "file_citation", None):
+            cited_file = file_links.get_file_metadata(get_client(), file_citation.file_id)
+            citations.append(
+                f"[{index}] {file_citation.quote} from {cited_file.filename}"
+            )
+        elif file_path := getattr(annotation, "file_path", None):
+            link_tag = create_file_link(
+                annotation.text.split("/")[-1],
+                file_path.file_id,
+            )
+            text_value = re.sub(r"\[(.*?)\]\s*\(\s*(.*?)\s*\)", link_tag, text_value)
+    text_value += "\n\n" + "\n".join(citations)
+    return text_value
+
+
+def stream_run(thread_id, assistant_id, event_handler, truncation_strategy=None):
+    metrics.count_api_call("openai", "runs.stream")
+    with get_client().beta.threads.runs.stream(
+        thread_id=thread_id,
+        assistant_id=assistant_id,
+        event_handler=event_handler,
+        truncation_strategy=truncation_strategy or openai.NOT_GIVEN,
+    ) as stream:
+        stream.until_done()
+
+    # Run id, usage, model and reply text normally all come from the stream
+    # events; the API is only asked again for whatever the stream did not carry.
+    run_id = event_handler.run_id
+    if not run_id:
+        metrics.count_api_call("openai", "messages.list")
+        last_message = get_client().beta.threads.messages.list(thread_id=thread_id, limit=1).data[0]
+        if last_message.role == "assistant":
+            run_id = last_message.run_id
+    if not run_id:
+        raise RuntimeError("Failed to retrieve run ID")
+
+    run_details = event_handler.run
+    if run_details is None or run_details.id != run_id or run_details.usage is None:
+        metrics.count_api_call("openai", "runs.retrieve")
+        run_details = get_client().beta.threads.runs.retrieve(thread_id=thread_id, run_id=run_id)
+
+    response = event_handler.final_text
+    if response is None and run_details.status == "cancelled":
+        response = ""
+    if response is None:
+        metrics.count_api_call("openai", "messages.list")
+        response = get_client().beta.threads.messages.list(thread_id=thread_id, limit=1).data[0].content[0].text.value
+    return run_details, response
+
+
+def save_run_history(session_id, username, student_id, user_input, response, run_details, on_error=None):
+    # Cancelled runs may end without usage; they are saved with what is known.
+    usage = run_details.usage
+    save_chat_history(
+        session_id,
+        username,
+        student_id,
+        user_input,
+        response,
+        run_details.assistant_id,
+        run_details.model,
+        usage.prompt_tokens if usage else 0,
+        usage.completion_tokens if usage else 0,
+        usage.total_tokens if usage else 0,
+        on_error=on_error,
+    )
+
+
+def cancel_openai_run(thread_id, run_id):
+    # Best effort: the run may have finished in the meantime.
+    metrics.count_api_call("openai", "runs.cancel")
+    try:
+        get_client().beta.threads.runs.cancel(thread_id=thread_id, run_id=run_id)
+    except openai.APIError:
+        metrics.incr("run_cancel_errors_total")
+
+
+def stopped_run(event_handler):
+    # The run kept streaming past RUN_CANCEL_GRACE and its stream was closed;
+    # take its usage from the API if it has settled by now.
+    run_details = event_handler.run
+    try:
+        metrics.count_api_call("openai", "runs.retrieve")
+        run_details = get_client().beta.threads.runs.retrieve(
+            thread_id=event_handler.thread_id, run_id=event_handler.run_id
+        )
+    except openai.APIError:
+        pass
+    return run_details, event_handler.final_text or event_handler.partial_text
+
+
+def record_turn_metrics(page, run_details, event_handler, started, finished, saved):
+    labels = {"assistant": run_details.assistant_id, "page": page, "model": run_details.model}
+    metrics.incr("turns_total", **labels)
+    metrics.observe("turn_seconds", saved - started, **labels)
+    metrics.observe("history_save_seconds", saved - finished, **labels)
+    metrics.observe("turn_api_calls", metrics.turn_api_calls(), **labels)
+    if event_handler.first_token_at is not None:
+        # Time to first token includes the run waiting in OpenAI's queue.
+        metrics.observe("turn_ttft_seconds", event_handler.first_token_at - started, **labels)
+        stream_seconds = finished - event_handler.first_token_at
+        metrics.observe("turn_stream_seconds", stream_seconds, **labels)
+        if run_details.usage and stream_seconds > 0:
+            metrics.observe(
+                "turn_tokens_per_second", run_details.usage.completion_tokens / stream_seconds, **labels
+            )
+    if run_details.usage:
+        metrics.observe("turn_prompt_tokens", run_details.usage.prompt_tokens, **labels)
+        metrics.observe("turn_completion_tokens", run_details.usage.completion_tokens, **labels)
+
+
+def compact_thread(current_page):
+    # Returns (truncation_strategy, prompt tokens before compaction or None,
+    # summarize) for the next run on this page's thread. A summary takes
+    # two API calls, so it is left to run_turn, once the turn is admitted.
+    mode = compaction.page_mode(current_page)
+    previous = st.session_state.setdefault('page_prompt_tokens', {}).get(current_page)
+    truncated_pages = st.session_state.setdefault('page_truncated', set())
+    compacted_from = None
+    summarize = False
+    if current_page in st.session_state.page_thread_ids and compaction.needs_compaction(mode, previous):
+        if mode == "summary":
+            summarize = True
+        elif current_page not in truncated_pages:
+            # Once a thread is truncated it stays truncated, or it would grow back.
+            truncated_pages.add(current_page)
+            compacted_from = previous
+    if mode == "truncate" and current_page in truncated_pages:
+        return compaction.truncation_strategy(), compacted_from, summarize
+    return None, compacted_from, summarize
+
+
+def summarize_thread(thread_id, student_id, page):
+    # A new thread seeded with a summary of thread_id, or None if that
+    # failed and the turn stays on thread_id. Through new_thread, so the new
+    # thread still searches the student's files.
+    try:
+        messages = compaction.summary_messages(get_client(), thread_id)
+        return new_thread(student_id, messages=messages).id
+    except openai.APIError:
+        metrics.incr("compaction_errors_total", page=page, mode="summary")
+        return None
+
+
+def run_turn(buffer, thread_id, content, file, assistant_id, truncation_strategy, session_id, username, student_id, user_input, page, cache_key, turn=None, summarize=False):
+    # Runs on a run_workers thread without any Streamlit calls; the page
+    # follows it through buffer and may come and go meanwhile. turn carries
+    # the API calls the script thread already made for this turn.
+    metrics.join_turn(turn)
+    controller = admission.get_controller()
+    try:
+        # Runs are admitted in a fair queue; the page shows the position meanwhile.
+        with controller.admit(
+            str(username or session_id),
+            on_wait=lambda position: buffer.append("queued", position),
+            cancelled=lambda: buffer.cancel_reason is not None,
+        ) as slot:
+            buffer.append("admitted")
+            if summarize:
+                summary_thread_id = summarize_thread(thread_id, student_id, page)
+                if summary_thread_id is not None:
+                    thread_id = summary_thread_id
+                    buffer.append("thread", thread_id)
+            event_handler = EventHandler(thread_id, buffer)
+            # Posted only once admitted: a turn stopped or timed out in the
+            # queue leaves no unanswered message on the thread.
+            create_message(thread_id, content, file, student_id)
+            started = time.monotonic()
+            try:
+                run_details, response = stream_run(thread_id, assistant_id, event_handler, truncation_strategy)
+            except run_workers.RunCancelled:
+                run_details, response = stopped_run(event_handler)
+            except Exception:
+                # Nobody will read the rest of this run.
+                if event_handler.run_id:
+                    cancel_openai_run(thread_id, event_handler.run_id)
+                raise
+            finished = time.monotonic()
+            slot.charge(run_details.usage.total_tokens if run_details.usage else 0)
+    except openai.RateLimitError:
+        controller.pause()
+        raise
+
+    if buffer.cancel_reason is not None:
+        metrics.incr("runs_cancelled_total", reason=buffer.cancel_reason, status=run_details.status)
+
+    # Save chat history after the stream is complete
+    save_run_history(
+        session_id, username, student_id, user_input, response, run_details,
+        on_error=lambda message: buffer.append("warning", message),
+    )
+    record_turn_metrics(page, run_details, event_handler, started, finished, time.monotonic())
+    metrics.end_turn()
+    if cache_key and run_details.status == "completed":
+        response_cache.get_cache().put(cache_key, response, run_details.model_dump_json())
+    return run_details, response
+
+
+def run_stream(user_input, file, selected_assistant_id, cache_key=None, content=None):
+    current_page = st.session_state.get('current_page', 'Unknown Page')
+    truncation_strategy, compacted_from, summarize = compact_thread(current_page)
+    
+    thread_id = create_thread(current_page)
+    
+    # The turn's API call count goes on with the run, on its worker.
+    turn = metrics.end_turn()
+    buffer = run_workers.get_pool().submit(
+        st.session_state.get('username') or str(st.session_state.get('session_id')),
+        current_page,
+        run_turn,
+        thread_id,
+        content or user_input,
+        file,
+        selected_assistant_id,
+        truncation_strategy,
+        st.session_state['session_id'],
+        st.session_state['username'],
+        get_session_student_id(),
+        user_input,
+        current_page,
+        cache_key,
+        turn,
+        summarize,
+    )
+    # offset: where the page replays the buffer from; committed: events
+    # already added to the chat log.
+    st.session_state.setdefault('page_runs', {})[current_page] = {
+        "key": buffer.key, "offset": 0, "committed": 0, "warnings": [], "compacted_from": compacted_from
+    }
+
+
+def has_active_run(current_page):
+    return current_page in st.session_state.get('page_runs', {})
+
+
+def cancel_page_run(current_page, reason="stop"):
+    page_run = st.session_state.get('page_runs', {}).get(current_page)
+    buffer = run_workers.get_pool().get(page_run["key"]) if page_run else None
+    if buffer is not None:
+        buffer.cancel(reason)
+
+
+def attach_run(current_page):
+    # Shows the page's run from its buffer and returns; follow_run polls the
+    # buffer from a fragment, so no script thread waits on the run. Replay
+    # starts after the last message already added to the chat log, so a
+    # rerun mid-answer (page switch, reconnect) picks up where it left off.
+    page_run = st.session_state.get('page_runs', {}).get(current_page)
+    if page_run is None:
+        return
+    buffer = run_workers.get_pool().get(page_run["key"])
+    if buffer is None:
+        # Expired before the student came back, or the process restarted.
+        st.session_state.page_runs.pop(current_page)
+        return
+    page_run["offset"] = page_run["committed"]
+    # The callback cancels the run; the fragment follows it to its end.
+    st.button(
+        "Stop",
+        key=f"stop_run_{current_page}",
+        on_click=cancel_page_run,
+        args=(current_page,),
+        disabled=buffer.cancel_reason is not None,
+    )
+    follow_run(current_page)
+
+
+@st.fragment(run_every=run_poll_interval)
+def follow_run(current_page):
+    # Each rerun redraws the run from page_run["offset"]; messages are added
+    # to the chat log once, and the whole page reruns when the run is over.
+    # The reply being streamed keeps one StreamRenderer across reruns, fed
+    # only the deltas it has not seen yet.
+    page_run = st.session_state.get('page_runs', {}).get(current_page)
+    if page_run is None:
+        return
+    buffer = run_workers.get_pool().get(page_run["key"])
+    if buffer is None:
+        st.session_state.page_runs.pop(current_page)
+        st.rerun()
+    streams = st.session_state.setdefault('page_streams', {})
+    stream = streams.get(current_page)
+    if stream is None or stream["key"] != page_run["key"]:
+        stream = streams[current_page] = {"key": page_run["key"], "offset": page_run["offset"], "renderer": None}
+    chat_log = st.session_state.page_chat_logs.setdefault(current_page, [])
+    notice = "Menghentikan jawaban..." if buffer.cancel_reason is not None else None
+    placeholder = None
+    text = ""
+    offset = page_run["offset"]
+    for kind, value in buffer.read(offset, timeout=0):
+        offset += 1
+        unseen = offset > stream["offset"]
+        if kind == "queued":
+            notice = f"Menunggu giliran... posisi antrean: {value}"
+        elif kind == "admitted":
+            notice = None
+        elif kind == "delta":
+            text += value
+            if placeholder is None:
+                with st.chat_message("Assistant"):
+                    placeholder = st.empty()
+            if unseen:
+                if stream["renderer"] is None:
+                    stream["renderer"] = StreamRenderer(placeholder)
+                stream["renderer"].placeholder = placeholder
+                stream["renderer"].feed(text)
+        elif kind == "message":
+            if offset > page_run["committed"]:
+                chat_log.append({"name": "assistant", "msg": value})
+                page_run["committed"] = offset
+            if unseen:
+                close_stream(stream)
+            if placeholder is None:
+                with st.chat_message("Assistant"):
+                    placeholder = st.empty()
+            placeholder.markdown(value, True)
+            placeholder = None
+            text = ""
+        elif kind == "warning":
+            page_run["warnings"].append(value)
+        elif kind == "thread":
+            # run_turn summarized the page's thread into this new one, which
+            # only has a summary of any inlined file.
+            st.session_state.page_thread_ids[current_page] = value
+            st.session_state.get('page_inlined_files', {}).pop(current_page, None)
+            page_run["compacted_from"] = st.session_state.get('page_prompt_tokens', {}).get(current_page)
+        elif kind == "done":
+            close_stream(streams.pop(current_page))
+            st.session_state.page_runs.pop(current_page)
+            st.session_state.setdefault('run_warnings', {})[current_page] = page_run["warnings"]
+            run_details, response = value
+            finish_run(current_page, run_details, page_run["compacted_from"])
+            st.rerun()
+        elif kind == "error":
+            close_stream(streams.pop(current_page))
+            st.session_state.page_runs.pop(current_page)
+            if isinstance(value, admission.AdmissionRejected) and value.reason == "cancelled":
+                st.rerun()
+            if isinstance(value, (admission.AdmissionRejected, openai.RateLimitError, run_workers.RunPoolFull)):
+                chat_log.append({"name": "assistant", "msg": busy_message})
+                st.rerun()
+            raise value
+    stream["offset"] = offset
+    if placeholder is not None and stream["renderer"] is not None:
+        stream["renderer"].placeholder = placeholder
+        stream["renderer"].show()
+    if notice:
+        st.info(notice)
+
+
+def close_stream(stream):
+    # Records the renderer's delta and render counts once its reply is over.
+    if stream["renderer"] is not None:
+        stream["renderer"].close()
+        stream["renderer"] = None
+
+
+def show_run_warnings(current_page):
+    # Problems the last run on this page hit without failing (e.g. saving history).
+    for warning in st.session_state.get('run_warnings', {}).pop(current_page, []):
+        st.warning(warning)
+
+
+def finish_run(current_page, run_details, compacted_from):
+    if run_details.usage:
+        st.session_state.setdefault('page_prompt_tokens', {})[current_page] = run_details.usage.prompt_tokens
+        if compacted_from is not None:
+            labels = {"page": current_page, "mode": compaction.page_mode(current_page)}
+            metrics.incr("compactions_total", **labels)
+            metrics.observe("compaction_prompt_tokens_before", compacted_from, **labels)
+            metrics.observe("compaction_prompt_tokens_after", run_details.usage.prompt_tokens, **labels)
+    enforce_chat_budget()
+
+
+def review_cache_key(user_input, uploaded_file, assistant_id):
+    # None when caching is off or the assistant's version cannot be read.
+    if not response_cache.RESPONSE_CACHE_ENABLED or uploaded_file is None:
+        return None
+    try:
+        version = response_cache.assistant_version(get_client(), assistant_id)
+    except openai.APIError:
+        metrics.incr("response_cache_errors_total")
+        return None
+    return response_cache.cache_key(
+        assistant_id, version, uploads.content_hash(uploaded_file), user_input
+    )
+
+
+def cached_review(cache_key):
+    cached = response_cache.get_cache().get(cache_key) if cache_key else None
+    if cached is None:
+        return None
+    response, run_json = cached
+    # construct() is as lenient as the SDK is with API responses.
+    run_details = Run.construct(**json.loads(run_json))
+    if run_details.usage:
+        metrics.incr("response_cache_tokens_saved_total", run_details.usage.total_tokens)
+    return response, run_details
+
+
+def save_cached_history(session_id, username, student_id, user_input, response, run_details, on_error=None):
+    save_chat_history(
+        session_id,
+        username,
+        student_id,
+        user_input,
+        response,
+        run_details.assistant_id,
+        run_details.model,
+        0,
+        0,
+        0,
+        cached=True,
+        on_error=on_error,
+    )
+
+
+def run_review(user_input, uploaded_file, assistant_id):
+    # The CV Reviewer prompt is fixed, so resubmitting the same file can reuse
+    # the earlier review without uploading the file or starting a run.
+    metrics.start_turn()
+    cache_key = review_cache_key(user_input, uploaded_file, assistant_id)
+    hit = cached_review(cache_key)
+    if hit is None:
+        content, file = prepare_upload(user_input, uploaded_file, upload_owner())
+        run_stream(user_input, file, assistant_id, cache_key=cache_key, content=content)
+        return None
+    metrics.end_turn()
+    response, run_details = hit
+    current_page = st.session_state.get('current_page', 'Unknown Page')
+    with st.chat_message("Assistant"):
+        st.markdown(response, True)
+    st.session_state.page_chat_logs.setdefault(current_page, []).append(
+        {"name": "assistant", "msg": response}
+    )
+    save_cached_history(
+        st.session_state['session_id'],
+        st.session_state['username'],
+        get_session_student_id(),
+        user_input,
+        response,
+        run_details,
+    )
+    enforce_chat_budget()
+    return response
+
+
+def run_headless(user_input, uploaded_file, assistant_id, session_id, username, student_id, page="Headless", errors=None, student_store=False):
+    # Same turn as run_stream on a fresh thread, without any Streamlit calls,
+    # for use from worker threads (e.g. CV Reviewer batch mode). Problems
+    # that do not fail the turn are appended to errors for the page to show.
+    # The files are not the student's own (a coach reviewing candidates'
+    # CVs), so they stay out of the student's vector store and each thread
+    # searches only its own attachment, unless student_store is set.
+    metrics.start_turn()
+    on_error = errors.append if errors is not None else None
+    cache_key = review_cache_key(user_input, uploaded_file, assistant_id)
+    hit = cached_review(cache_key)
+    if hit is not None:
+        response, run_details = hit
+        save_cached_history(session_id, username, student_id, user_input, response, run_details, on_error)
+        metrics.end_turn()
+        return response, run_details
+    content, file = prepare_upload(user_input, uploaded_file, str(student_id or username))
+    store_owner = student_id if student_store else None
+    thread = new_thread(store_owner)
+    metrics.incr("threads_used_total")
+    event_handler = RunEventHandler(thread.id)
+    controller = admission.get_controller()
+    try:
+        with controller.admit(str(username or session_id)) as slot:
+            create_message(thread.id, content, file, store_owner)
+            started = time.monotonic()
+            run_details, response = stream_run(thread.id, assistant_id, event_handler)
+            finished = time.monotonic()
+            slot.charge(run_details.usage.total_tokens if run_details.usage else 0)
+    except openai.RateLimitError:
+        controller.pause()
+        raise
+    save_run_history(session_id, username, student_id, user_input, response, run_details, on_error)
+    record_turn_metrics(page, run_details, event_handler, started, finished, time.monotonic())
+    metrics.end_turn()
+    if cache_key and run_details.status == "completed":
+        response_cache.get_cache().put(cache_key, response, run_details.model_dump_json())
+    return response, run_details
+
+def run_batch(buffer, jobs, assistant_id, session_id, username, student_id, page, concurrency):
+    # Runs on a run_workers thread: reviews each (name, user_input, file) with
+    # run_headless, at most concurrency at once, and appends an "item" event
+    # per finished review for the page to show. Returns the items in order.
+    def review(name, user_input, uploaded_file):
+        if buffer.cancel_reason is not None:
+            item = {"File": name, "Status": "cancelled", "Tokens": 0, "Review": "", "Errors": []}
+            buffer.append("item", item)
+            return item
+        errors = []
+        try:
+            response, run_details = run_headless(
+                user_input, uploaded_file, assistant_id, session_id, username, student_id, page, errors
+            )
+        except Exception as e:
+            item = {"File": name, "Status": f"error: {e}", "Tokens": 0, "Review": "", "Errors": errors}
+        else:
+            tokens = run_details.usage.total_tokens if run_details.usage else 0
+            item = {"File": name, "Status": "done", "Tokens": tokens, "Review": response, "Errors": errors}
+        buffer.append("item", item)
+        return item
+
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="batch") as pool:
+        futures = [pool.submit(review, *job) for job in jobs]
+    return [future.result() for future in futures]
+
+
+def start_batch_review(jobs, assistant_id, concurrency):
+    # The batch runs on a worker, so the script run ends right away; the page
+    # follows it with batch_events() from a fragment.
+    current_page = st.session_state.get('current_page', 'Unknown Page')
+    buffer = run_workers.get_pool().submit(
+        st.session_state.get('username') or str(st.session_state.get('session_id')),
+        current_page,
+        run_batch,
+        jobs,
+        assistant_id,
+        st.session_state['session_id'],
+        st.session_state.get('username'),
+        st.session_state.get('student_id'),
+        current_page,
+        concurrency,
+        # A batch of many CVs is left to finish while the coach is away;
+        # it ends on its own, or on logout.
+        watched=False,
+    )
+    return {"key": buffer.key, "total": len(jobs)}
+
+
+def cancel_batch(batch, reason):
+    buffer = run_workers.get_pool().get(batch["key"])
+    if buffer is not None:
+        buffer.cancel(reason)
+
+
+def batch_events(batch):
+    # Everything the batch reported so far, or None if its buffer is gone
+    # (expired, or started on another replica or before a restart).
+    buffer = run_workers.get_pool().get(batch["key"])
+    return None if buffer is None else buffer.read(0, timeout=0)
+
+
+def get_session_student_id():
+    # Resolved at login; sessions that logged in before that fall back to the index.
+    if st.session_state.get('student_id') is None:
+        st.session_state['student_id'] = get_student_id(st.session_state['username'])
+    return st.session_state['student_id']
+
+def upload_owner():
+    # Uploads are cached by content hash per student, so re-sending the same
+    # file on later turns or other pages reuses the existing OpenAI file.
+    return str(st.session_state.get('student_id') or st.session_state.get('username', ''))
+
+
+def show_older_messages(current_page):
+    window_sizes = st.session_state.setdefault('chat_window_sizes', {})
+    shown = window_sizes.get(current_page, chat_window_turns * 2)
+    window_sizes[current_page] = shown + chat_window_page_turns * 2
+
+
+def enforce_chat_budget():
+    session_id = st.session_state.get('session_id')
+    if not session_id:
+        return
+    spilled_counts = st.session_state.setdefault('page_chat_spilled', {})
+    used = chat_store.enforce_budget(session_id, st.session_state.page_chat_logs, spilled_counts)
+    st.session_state['chat_memory_bytes'] = used
+    metrics.observe("chat_session_memory_bytes", used)
+
+
+@st.fragment
+def render_chat_history(current_page):
+    # Only the newest turns are rendered; the stored messages are already
+    # formatted, so older pages are added without rebuilding anything, and
+    # the "show older" button reruns just this fragment. Turns that were
+    # spilled to the chat store are read back only when the window reaches them.
+    chats = st.session_state.page_chat_logs.get(current_page, [])
+    spilled = st.session_state.get('page_chat_spilled', {}).get(current_page, 0)
+    total = spilled + len(chats)
+    shown = st.session_state.get('chat_window_sizes', {}).get(current_page, chat_window_turns * 2)
+    hidden = max(0, total - shown)
+    if hidden:
+        st.button(
+            f"Tampilkan pesan sebelumnya ({hidden})",
+            key=f"show_older_{current_page}",
+            on_click=show_older_messages,
+            args=(current_page,),
+            disabled=st.session_state.in_progress,
+        )
+    if hidden < spilled:
+        window = chat_store.get_store().load(
+            st.session_state['session_id'], current_page, hidden, spilled
+        ) + chats
+    else:
+        window = chats[hidden - spilled:]
+    metrics.observe("chat_messages_rendered", len(window))
+    for chat in window:
+        with st.chat_message(chat["name"]):
+            st.markdown(chat["msg"], True)
+
+
+def render_chat():
+    current_page = st.session_state.get('current_page', 'Unknown Page')
+    if current_page in st.session_state.page_chat_logs:
+        render_chat_history(current_page)
+
+
+def disable_form():
+    st.session_state.in_progress = True
+
+
+def reset_chat():
+    current_page = st.session_state.get('current_page', 'Unknown Page')
+    if current_page in st.session_state.page_chat_logs:
+        st.session_state.page_chat_logs[current_page] = []
+    st.session_state.get('chat_window_sizes', {}).pop(current_page, None)
+    if st.session_state.get('page_chat_spilled', {}).pop(current_page, None):
+        chat_store.get_store().drop(st.session_state['session_id'], current_page)
+    st.session_state.in_progress = False
+
+def load_chat_screen(assistant_id, assistant_title):
+    current_page = st.session_state.get('current_page', 'Unknown Page')
+
+    uploaded_file = st.sidebar.file_uploader(
+        enabled_file_upload_message,
+        type=[
+            "txt",
+            "pdf",
+            "docx",
+            "json",
+        ],
+        disabled=st.session_state.in_progress,
+    )
+
+    # Initialize chat logs and thread ID for the current page if they don't exist
+    if 'page_chat_logs' not in st.session_state:
+        st.session_state.page_chat_logs = {}
+    if 'page_thread_ids' not in st.session_state:
+        st.session_state.page_thread_ids = {}
+    
+    if current_page not in st.session_state.page_chat_logs:
+        st.session_state.page_chat_logs[current_page] = []
+
+    st.title(assistant_title if assistant_title else "")
+    st.success("Placeholder untuk cara penggunaan assistant")
+    st.write(f"Halo, bisa perkenalkan namamu?")
+    
+    # Render existing chat for this page
+    render_chat_history(current_page)
+    show_run_warnings(current_page)
+
+    running = has_active_run(current_page)
+    user_msg = st.chat_input(
+        "Message", on_submit=disable_form, disabled=st.session_state.in_progress or running
+    )
+    if user_msg:
+        with st.chat_message("user"):
+            st.markdown(user_msg, True)
+        st.session_state.page_chat_logs[current_page].append({"name": "user", "msg": user_msg})
+
+        # Counts the API calls of the whole turn, including the upload here.
+        metrics.start_turn()
+        inlined = st.session_state.setdefault('page_inlined_files', {}).setdefault(current_page, set())
+        content, file = prepare_upload(user_msg, uploaded_file, upload_owner(), inlined)
+        run_stream(user_msg, file, assistant_id, content=content)
+        st.session_state.in_progress = False
+        st.session_state.tool_call = None
+        # The answer is followed by a fragment, which reruns the page when it is done.
+        attach_run(current_page)
+    elif running:
+        # Started before a page switch or reconnect and still going (or done
+        # while the student was away): follow it from where the log stops.
+        metrics.incr("runs_reattached_total")
+        st.session_state.in_progress = False
+        attach_run(current_page)
+    elif st.session_state.in_progress:
+        # Left over from a turn whose page was switched away from mid-answer.
+        st.session_state.in_progress = False
+        st.rerun()
+
+def login():
+    st.markdown(
+    """
+    <style>
+    .css-1jc7ptx, .e1ewe7hr3, .viewerBadge_container__1QSob,
+    .styles_viewerBadge__1yB5_, .viewerBadge_link__1S137,
+    .viewerBadge_text__1JaDK {
+        display: none;
+    }
+    </style>
+    """,
+    unsafe_allow_html=True
+    )
+    st.title("💬 RevoU AI Coach")
+    st.text("Enter your credential")
+    username = st.text_input("Username")
+    password = st.text_input("Password", type="password")
+    if st.button("Login"):
+        user = get_user(username, fresh=True)
+        if user:
+            if 'Password' in user['fields']:
+                if verify_password(user['fields']['Password'], password):
+                    st.session_state['logged_in'] = True
+                    st.session_state['username'] = username
+                    st.session_state['student_id'] = user['fields'].get('StudentID')
+                    # A token handed out before login must not carry the login.
+                    end_stored_session(rotate=True)
+                    st.success("Login successful!")
+                    st.rerun()
+                else:
+                    st.error("Invalid password")
+            else:
+                st.error("User record does not contain a password field")
+        else:
+            st.error("User not found")
+
+def logout():
+    # Runs still streaming for this session would otherwise go on unread.
+    for page in list(st.session_state.get('page_runs', {})):
+        cancel_page_run(page, reason="logout")
+    batch = st.session_state.get('resume_reviewer_state', {}).get('batch')
+    if batch is not None:
+        cancel_batch(batch, reason="logout")
+    st.session_state.pop('resume_reviewer_state', None)
+    session_id = st.session_state.get('session_id')
+    if session_id:
+        if st.session_state.pop('page_chat_spilled', None):
+            chat_store.get_store().drop(session_id)
+        chat_store.report_memory(session_id, 0)
+    st.session_state['logged_in'] = False
+    st.session_state.pop('username', None)
+    st.session_state.pop('student_id', None)
+    st.session_state['chat_history'] = []
+    # The next login is a new session, with its own chat budget and history SessionID.
+    st.session_state['session_id'] = generate_session_id()
+    st.session_state.page_thread_ids = {}
+    st.session_state.page_chat_logs = {}
+    st.session_state.pop('used_thread_ids', None)
+    st.session_state.pop('chat_window_sizes', None)
+    st.session_state.pop('page_prompt_tokens', None)
+    st.session_state.pop('page_truncated', None)
+    st.session_state.pop('page_inlined_files', None)
+    st.session_state.pop('page_runs', None)
+    end_stored_session(rotate=False)
+    st.success("Logged out successfully!")
+    reset_chat()
+    st.rerun()
@@ -0,0 +1,94 @@
+import io
+import os
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as ExtractionTimeoutError
+from xml.etree import ElementTree
+
+import metrics
+
+# Small text documents are sent inline instead of as file_search/code_interpreter
+# attachments, which make the run wait for vector store indexing.
+EXTRACT_ENABLED = os.environ.get("EXTRACT_ENABLED", "true").lower() == "true"
+EXTRACT_MAX_BYTES = int(os.environ.get("EXTRACT_MAX_BYTES", 2 * 1024 * 1024))
+# Longer extracted text goes back to being an attachment (roughly 15k tokens).
+EXTRACT_MAX_CHARS = int(os.environ.get("EXTRACT_MAX_CHARS", 60000))
+# Below this the PDF is probably scanned images; let code_interpreter handle it.
+EXTRACT_MIN_CHARS = int(os.environ.get("EXTRACT_MIN_CHARS", 200))
+EXTRACT_TIMEOUT = float(os.environ.get("EXTRACT_TIMEOUT", 10))
+EXTRACT_MAX_WORKERS = int(os.environ.get("EXTRACT_MAX_WORKERS", 4))
+
+TEXT_EXTENSIONS = (".txt", ".json", ".md")
+WORD_NAMESPACE = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+
+_executor = ThreadPoolExecutor(max_workers=EXTRACT_MAX_WORKERS, thread_name_prefix="extract")
+
+
+def _text_from_docx(data):
+    with zipfile.ZipFile(io.BytesIO(data)) as docx:
+        root = ElementTree.fromstring(docx.read("word/document.xml"))
+    paragraphs = []
+    for paragraph in root.iter(f"{WORD_NAMESPACE}p"):
+        parts = []
+        for node in paragraph.iter():
+            if node.tag == f"{WORD_NAMESPACE}t" and node.text:
+                parts.append(node.text)
+            elif node.tag == f"{WORD_NAMESPACE}tab":
+                parts.append("\t")
+        paragraphs.append("".join(parts))
+    return "\n".join(paragraphs)
+
+
+def _text_from_pdf(data):
+    # Imported on first use; most turns have no PDF.
+    from pypdf import PdfReader
+
+    reader = PdfReader(io.BytesIO(data))
+    return "\n".join(page.extract_text() or "" for page in reader.pages)
+
+
+def _extract(name, data):
+    lowered = name.lower()
+    if lowered.endswith(TEXT_EXTENSIONS):
+        return data.decode("utf-8", errors="replace")
+    if lowered.endswith(".docx"):
+        return _text_from_docx(data)
+    if lowered.endswith(".pdf"):
+        return _text_from_pdf(data)
+    return None
+
+
+def extract_text(uploaded_file):
+    """Text of a small PDF/DOCX/TXT upload, or None when it should stay an attachment."""
+    if not EXTRACT_ENABLED:
+        return None
+    # Checked before copying anything; uploads may be up to 200MB.
+    if uploaded_file.size > EXTRACT_MAX_BYTES:
+        metrics.incr("extraction_skipped_total", reason="size")
+        return None
+    future = _executor.submit(_extract, uploaded_file.name, bytes(uploaded_file.getbuffer()))
+    try:
+        text = future.result(timeout=EXTRACT_TIMEOUT)
+    except ExtractionTimeoutError:
+        future.cancel()
+        metrics.incr("extraction_skipped_total", reason="timeout")
+        return None
+    except Exception:
+        metrics.incr("extraction_skipped_total", reason="error")
+        return None
+    if text is None:
+        metrics.incr("extraction_skipped_total", reason="format")
+        return None
+    text = text.strip()
+    if len(text) > EXTRACT_MAX_CHARS:
+        metrics.incr("extraction_skipped_total", reason="length")
+        return None
+    if uploaded_file.name.lower().endswith(".pdf") and len(text) < EXTRACT_MIN_CHARS:
+        metrics.incr("extraction_skipped_total", reason="no_text")
+        return None
+    metrics.incr("extraction_inlined_total")
+    return text
+
+
+def inline_content(user_input, file_name, text):
+    return f"{user_input}\n\n--- Isi file {file_name} ---\n{text}\n--- Akhir file {file_name} ---"
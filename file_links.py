@@ -0,0 +1,91 @@
+import hashlib
+import hmac
+import os
+import secrets
+import shutil
+import threading
+import time
+from urllib.parse import quote
+
+import metrics
+from cache import TTLCache
+
+FILE_METADATA_CACHE_SIZE = int(os.environ.get("FILE_METADATA_CACHE_SIZE", 2048))
+FILE_METADATA_CACHE_TTL = float(os.environ.get("FILE_METADATA_CACHE_TTL", 3600))
+# Generated files live under Streamlit's static folder (server.enableStaticServing)
+# and are served from app/static/generated/<key>/<name>. Static files are
+# served to anyone, so <key> is an HMAC of the file id that cannot be guessed
+# from it. Replicas sharing the folder must share the secret.
+GENERATED_FILES_DIR = os.path.join("static", "generated")
+GENERATED_FILES_URL = "app/static/generated"
+GENERATED_FILES_TTL = float(os.environ.get("GENERATED_FILES_TTL", 7 * 24 * 3600))
+GENERATED_FILES_SECRET = (
+    os.environ.get("GENERATED_FILES_SECRET")
+    or os.environ.get("STREAMLIT_SERVER_COOKIE_SECRET")
+    or secrets.token_hex(32)
+)
+
+_metadata = TTLCache(FILE_METADATA_CACHE_SIZE, FILE_METADATA_CACHE_TTL)
+# One download per file at a time; different files download in parallel.
+_download_locks = {}
+_download_locks_lock = threading.Lock()
+
+
+def get_file_metadata(client, file_id):
+    file = _metadata.get(file_id)
+    if file is not None:
+        metrics.incr("file_metadata_cache_hits_total")
+        return file
+    metrics.incr("file_metadata_cache_misses_total")
+    metrics.count_api_call("openai", "files.retrieve")
+    file = client.files.retrieve(file_id)
+    _metadata.set(file_id, file)
+    return file
+
+
+def _safe_name(file_name):
+    return os.path.basename(file_name.replace("\\", "/")) or "download"
+
+
+def _file_key(file_id):
+    return hmac.new(GENERATED_FILES_SECRET.encode(), file_id.encode(), hashlib.sha256).hexdigest()
+
+
+def _download_lock(key):
+    with _download_locks_lock:
+        return _download_locks.setdefault(key, threading.Lock())
+
+
+def generated_file_url(client, file_name, file_id):
+    """Stream a generated file to the static folder once and return its link."""
+    file_name = _safe_name(file_name)
+    key = _file_key(file_id)
+    directory = os.path.join(GENERATED_FILES_DIR, key)
+    path = os.path.join(directory, file_name)
+    with _download_lock(key):
+        if not os.path.exists(path):
+            _evict_expired()
+            os.makedirs(directory, exist_ok=True)
+            partial = path + ".part"
+            started = time.monotonic()
+            metrics.count_api_call("openai", "files.content")
+            with client.files.with_streaming_response.content(file_id) as response:
+                response.stream_to_file(partial)
+            os.replace(partial, path)
+            metrics.observe("generated_file_download_seconds", time.monotonic() - started)
+            metrics.incr("generated_file_bytes_total", os.path.getsize(path))
+        else:
+            metrics.incr("generated_file_cache_hits_total")
+    # The file is in place, so a thread arriving now will not download it again.
+    with _download_locks_lock:
+        _download_locks.pop(key, None)
+    return f"{GENERATED_FILES_URL}/{key}/{quote(file_name)}"
+
+
+def _evict_expired():
+    if not os.path.isdir(GENERATED_FILES_DIR):
+        return
+    cutoff = time.time() - GENERATED_FILES_TTL
+    for entry in os.scandir(GENERATED_FILES_DIR):
+        if entry.is_dir() and entry.stat().st_mtime < cutoff:
+            shutil.rmtree(entry.path, ignore_errors=True)
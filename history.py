@@ -0,0 +1,405 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+
+from pyairtable.formulas import match
+
+import metrics
+from settings import CACHE_DIR, connect_sqlite
+
+HISTORY_SPOOL_PATH = os.environ.get(
+    "HISTORY_SPOOL_PATH", os.path.join(CACHE_DIR, "chat_history_spool.sqlite3")
+)
+HISTORY_QUEUE_SIZE = int(os.environ.get("HISTORY_QUEUE_SIZE", 1000))
+HISTORY_FLUSH_INTERVAL = float(os.environ.get("HISTORY_FLUSH_INTERVAL", 2))
+HISTORY_MAX_RETRIES = int(os.environ.get("HISTORY_MAX_RETRIES", 5))
+HISTORY_RETRY_BASE_DELAY = float(os.environ.get("HISTORY_RETRY_BASE_DELAY", 1))
+HISTORY_RETRY_MAX_DELAY = float(os.environ.get("HISTORY_RETRY_MAX_DELAY", 30))
+# "airtable" writes only to Airtable; "sqlite" keeps an indexed local copy
+# (and also writes to Airtable when HISTORY_SQLITE_MIRROR is true).
+HISTORY_BACKEND = os.environ.get("HISTORY_BACKEND", "airtable").lower()
+HISTORY_DB_PATH = os.environ.get(
+    "HISTORY_DB_PATH", os.path.join(CACHE_DIR, "chat_history.sqlite3")
+)
+HISTORY_SQLITE_MIRROR = os.environ.get("HISTORY_SQLITE_MIRROR", "true").lower() == "true"
+# Set once the Airtable Chat History table has a "Cached" checkbox field;
+# until then cached turns are written to Airtable without it.
+HISTORY_CACHED_FIELD = os.environ.get("HISTORY_CACHED_FIELD", "false").lower() == "true"
+
+# Airtable accepts at most 10 records per batch create.
+AIRTABLE_BATCH_SIZE = 10
+# Airtable rejected the records themselves (e.g. 422 for an unknown field);
+# resending them as they are cannot succeed.
+PERMANENT_STATUSES = (400, 413, 422)
+# Fields a rejected record is retried without before it is set aside, so a
+# missing optional column never costs the turn itself.
+OPTIONAL_FIELDS = ("Cached",)
+
+log = logging.getLogger(__name__)
+
+
+class Spool:
+    """On-disk copy of every record that has not reached Airtable yet."""
+
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        self._conn = connect_sqlite(path)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS spool ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "fields TEXT NOT NULL, "
+            "queued INTEGER NOT NULL DEFAULT 0)"
+        )
+        # Records Airtable will not accept, kept for someone to fix and replay.
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS dead_letter ("
+            "id INTEGER PRIMARY KEY, "
+            "fields TEXT NOT NULL, "
+            "error TEXT NOT NULL, "
+            "failed_at REAL NOT NULL)"
+        )
+        # Anything marked queued belonged to a previous process.
+        self._conn.execute("UPDATE spool SET queued = 0")
+        self._conn.commit()
+
+    def add(self, fields, queued):
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO spool (fields, queued) VALUES (?, ?)",
+                (json.dumps(fields), int(queued)),
+            )
+            self._conn.commit()
+            return cursor.lastrowid
+
+    def set_queued(self, ids, queued):
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE spool SET queued = ? WHERE id = ?",
+                [(int(queued), record_id) for record_id in ids],
+            )
+            self._conn.commit()
+
+    def unqueued(self, limit):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, fields FROM spool WHERE queued = 0 ORDER BY id LIMIT ?",
+                (limit,),
+            ).fetchall()
+        return [(record_id, json.loads(fields)) for record_id, fields in rows]
+
+    def remove(self, ids):
+        with self._lock:
+            self._conn.executemany(
+                "DELETE FROM spool WHERE id = ?", [(record_id,) for record_id in ids]
+            )
+            self._conn.commit()
+
+    def dead_letter(self, ids, error):
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO dead_letter (id, fields, error, failed_at) "
+                "SELECT id, fields, ?, ? FROM spool WHERE id = ?",
+                [(error, time.time(), record_id) for record_id in ids],
+            )
+            self._conn.executemany(
+                "DELETE FROM spool WHERE id = ?", [(record_id,) for record_id in ids]
+            )
+            self._conn.commit()
+
+    def count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM spool").fetchone()[0]
+
+
+class HistoryWriter:
+    """Write-behind pipeline for Chat History records.
+
+    Records from every session in the process go to the spool first, then
+    through a bounded in-memory queue to a single worker that writes them
+    with Airtable batch creates. Records that do not fit in the queue, or
+    whose batch keeps failing, stay in the spool and are picked up again
+    once the queue has drained.
+    """
+
+    def __init__(self, table_factory, spool_path=HISTORY_SPOOL_PATH, queue_size=HISTORY_QUEUE_SIZE):
+        self._table_factory = table_factory
+        self._table = None
+        self._spool = Spool(spool_path)
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._stop = threading.Event()
+        self._refill_after = 0.0
+        self._thread = threading.Thread(
+            target=self._run, name="chat-history-writer", daemon=True
+        )
+        self._thread.start()
+
+    def enqueue(self, fields):
+        record_id = self._spool.add(fields, queued=True)
+        try:
+            self._queue.put_nowait((record_id, fields))
+        except queue.Full:
+            self._spool.set_queued([record_id], False)
+            metrics.incr("history_queue_overflow_total")
+        metrics.incr("history_records_enqueued_total")
+        self._report_depth()
+
+    def depth(self):
+        return self._spool.count()
+
+    def stop(self, timeout=5):
+        self._stop.set()
+        self._thread.join(timeout)
+
+    def _report_depth(self):
+        metrics.gauge("history_queue_depth", self._queue.qsize())
+        metrics.gauge("history_spool_depth", self._spool.count())
+
+    def _next_batch(self):
+        try:
+            batch = [self._queue.get(timeout=HISTORY_FLUSH_INTERVAL)]
+        except queue.Empty:
+            self._refill()
+            return []
+        while len(batch) < AIRTABLE_BATCH_SIZE:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _refill(self):
+        if time.monotonic() < self._refill_after:
+            return
+        free = self._queue.maxsize - self._queue.qsize()
+        rows = self._spool.unqueued(free)
+        if not rows:
+            return
+        self._spool.set_queued([record_id for record_id, _ in rows], True)
+        for index, row in enumerate(rows):
+            try:
+                # enqueue() from a session may have taken the room meanwhile.
+                self._queue.put(row, block=False)
+            except queue.Full:
+                self._spool.set_queued([record_id for record_id, _ in rows[index:]], False)
+                break
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                batch = self._next_batch()
+                if batch:
+                    self._flush(batch)
+                    self._report_depth()
+            except Exception:
+                # Whatever went wrong, the records are still spooled; keep the writer alive.
+                log.exception("Chat History writer failed; continuing")
+                metrics.incr("history_writer_errors_total")
+                self._stop.wait(HISTORY_FLUSH_INTERVAL)
+
+    def _flush(self, batch):
+        ids = [record_id for record_id, _ in batch]
+        records = [fields for _, fields in batch]
+        started = time.monotonic()
+        for attempt in range(HISTORY_MAX_RETRIES + 1):
+            try:
+                if self._table is None:
+                    self._table = self._table_factory()
+                self._table.batch_create(records)
+            except Exception as e:
+                metrics.incr("history_flush_errors_total")
+                if _is_permanent(e):
+                    self._split(batch, e)
+                    return
+                if attempt == HISTORY_MAX_RETRIES or self._stop.is_set():
+                    break
+                delay = min(HISTORY_RETRY_MAX_DELAY, HISTORY_RETRY_BASE_DELAY * 2 ** attempt)
+                self._stop.wait(delay * random.uniform(0.5, 1.0))
+                continue
+            self._spool.remove(ids)
+            metrics.incr("history_records_written_total", len(records))
+            metrics.observe("history_flush_seconds", time.monotonic() - started)
+            metrics.observe("history_batch_size", len(records))
+            return
+        # Give up for now; the records stay spooled and are retried on refill.
+        self._spool.set_queued(ids, False)
+        self._refill_after = time.monotonic() + HISTORY_RETRY_MAX_DELAY
+        metrics.incr("history_records_deferred_total", len(records))
+
+    def _split(self, batch, error):
+        # One rejected record fails its whole batch, so halve the batch until
+        # it is alone, and set it aside instead of blocking the others.
+        if len(batch) > 1:
+            middle = len(batch) // 2
+            self._flush(batch[:middle])
+            self._flush(batch[middle:])
+            return
+        record_id, fields = batch[0]
+        optional = [name for name in OPTIONAL_FIELDS if name in fields]
+        if optional:
+            metrics.incr("history_optional_fields_dropped_total")
+            self._flush([(record_id, {name: value for name, value in fields.items() if name not in optional})])
+            return
+        log.warning("Chat History record rejected by Airtable: %s", error)
+        self._spool.dead_letter([batch[0][0]], str(error))
+        metrics.incr("history_records_dead_lettered_total")
+
+
+def _is_permanent(error):
+    response = getattr(error, "response", None)
+    return getattr(response, "status_code", None) in PERMANENT_STATUSES
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_writer(table_factory):
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = HistoryWriter(table_factory)
+            atexit.register(_writer.stop)
+        return _writer
+
+
+HISTORY_COLUMNS = [
+    ("SessionID", "TEXT"),
+    ("Timestamp", "INTEGER"),
+    ("StudentID", "TEXT"),
+    ("Username", "TEXT"),
+    ("UserInput", "TEXT"),
+    ("Response", "TEXT"),
+    ("AssistantID", "TEXT"),
+    ("Model", "TEXT"),
+    ("PromptTokens", "INTEGER"),
+    ("CompletionTokens", "INTEGER"),
+    ("TotalTokens", "INTEGER"),
+    ("Cached", "INTEGER"),
+]
+INDEXED_COLUMNS = ["StudentID", "SessionID", "AssistantID", "Timestamp"]
+
+
+class AirtableHistoryStore:
+    """Chat History in Airtable, written through the HistoryWriter."""
+
+    def __init__(self, table_factory):
+        self._table_factory = table_factory
+        self._writer = get_writer(table_factory)
+
+    def save(self, fields):
+        if not HISTORY_CACHED_FIELD:
+            fields = {name: value for name, value in fields.items() if name != "Cached"}
+        self._writer.enqueue(fields)
+
+    def query(self, student_id=None, session_id=None, assistant_id=None, since=None, until=None):
+        conditions = []
+        equals = {
+            "StudentID": student_id,
+            "SessionID": session_id,
+            "AssistantID": assistant_id,
+        }
+        equals = {field: value for field, value in equals.items() if value is not None}
+        if equals:
+            conditions.append(match(equals))
+        if since is not None:
+            conditions.append(f"{{Timestamp}} >= {int(since)}")
+        if until is not None:
+            conditions.append(f"{{Timestamp}} < {int(until)}")
+        formula = f"AND({', '.join(conditions)})" if conditions else None
+        metrics.count_api_call("airtable", "chat_history.all")
+        records = self._table_factory().all(formula=formula)
+        rows = [record["fields"] for record in records]
+        return sorted(rows, key=lambda row: row.get("Timestamp") or 0)
+
+
+class SQLiteHistoryStore:
+    """Chat History in a local SQLite database (WAL), optionally mirrored to another store."""
+
+    def __init__(self, path=HISTORY_DB_PATH, mirror=None):
+        self._mirror = mirror
+        self._lock = threading.Lock()
+        self._conn = connect_sqlite(path)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        columns = ", ".join(f"{name} {kind}" for name, kind in HISTORY_COLUMNS)
+        self._conn.execute(
+            f"CREATE TABLE IF NOT EXISTS chat_history (id INTEGER PRIMARY KEY AUTOINCREMENT, {columns})"
+        )
+        existing = {row[1] for row in self._conn.execute("PRAGMA table_info(chat_history)")}
+        for name, kind in HISTORY_COLUMNS:
+            if name not in existing:
+                self._conn.execute(f"ALTER TABLE chat_history ADD COLUMN {name} {kind}")
+        for column in INDEXED_COLUMNS:
+            self._conn.execute(
+                f"CREATE INDEX IF NOT EXISTS chat_history_{column.lower()} ON chat_history ({column})"
+            )
+        # Lets "this student's turns in a time range" use one index.
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS chat_history_student_time "
+            "ON chat_history (StudentID, Timestamp)"
+        )
+        self._conn.commit()
+
+    def save(self, fields):
+        names = [name for name, _ in HISTORY_COLUMNS]
+        with self._lock:
+            self._conn.execute(
+                f"INSERT INTO chat_history ({', '.join(names)}) "
+                f"VALUES ({', '.join('?' for _ in names)})",
+                [fields.get(name) for name in names],
+            )
+            self._conn.commit()
+        metrics.incr("history_sqlite_writes_total")
+        if self._mirror is not None:
+            self._mirror.save(fields)
+
+    def query(self, student_id=None, session_id=None, assistant_id=None, since=None, until=None):
+        conditions = []
+        params = []
+        for column, value in (
+            ("StudentID", student_id),
+            ("SessionID", session_id),
+            ("AssistantID", assistant_id),
+        ):
+            if value is not None:
+                conditions.append(f"{column} = ?")
+                params.append(value)
+        if since is not None:
+            conditions.append("Timestamp >= ?")
+            params.append(int(since))
+        if until is not None:
+            conditions.append("Timestamp < ?")
+            params.append(int(until))
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        names = [name for name, _ in HISTORY_COLUMNS]
+        started = time.monotonic()
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT {', '.join(names)} FROM chat_history {where} ORDER BY Timestamp, id",
+                params,
+            ).fetchall()
+        metrics.observe("history_query_seconds", time.monotonic() - started, backend="sqlite")
+        return [dict(zip(names, row)) for row in rows]
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store(table_factory):
+    global _store
+    with _store_lock:
+        if _store is None:
+            if HISTORY_BACKEND == "sqlite":
+                mirror = AirtableHistoryStore(table_factory) if HISTORY_SQLITE_MIRROR else None
+                _store = SQLiteHistoryStore(mirror=mirror)
+            elif HISTORY_BACKEND == "airtable":
+                _store = AirtableHistoryStore(table_factory)
+            else:
+                raise ValueError(f"Unknown HISTORY_BACKEND: {HISTORY_BACKEND}")
+        return _store
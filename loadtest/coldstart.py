@@ -0,0 +1,99 @@
+"""Measure cold-start cost: importing core and the first render of a page.
+
+Every sample runs in a fresh interpreter, as a new container would, against
+the local stand-in (loadtest.stub_server) so no network time is included:
+
+    python -m loadtest.coldstart --repeat 5 --json > coldstart.json
+
+Reports the median and minimum of:
+  import_core_seconds    `import core` (what every page script pays)
+  first_render_seconds   first run of Home.py rendering an assistant page
+  warm_render_seconds    the next rerun of the same page in the same process
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from loadtest import run, stub_server
+
+
+def measure_import():
+    started = time.perf_counter()
+    import core  # noqa: F401
+    return {"import_core_seconds": time.perf_counter() - started}
+
+
+def measure_render():
+    from streamlit.testing.v1 import AppTest
+
+    at = AppTest.from_file(run.MAIN_SCRIPT, default_timeout=120)
+    at.session_state["logged_in"] = True
+    at.session_state["username"] = "student0"
+    at.session_state["student_id"] = "S00000"
+    at.session_state["page_chat_logs"] = {}
+    at.session_state["page_thread_ids"] = {}
+    started = time.perf_counter()
+    at.switch_page(run.PAGE_SCRIPT).run()
+    first = time.perf_counter() - started
+    if at.exception:
+        raise RuntimeError(at.exception[0].message)
+    started = time.perf_counter()
+    at.run()
+    return {"first_render_seconds": first, "warm_render_seconds": time.perf_counter() - started}
+
+
+def sample(mode):
+    output = subprocess.run(
+        [sys.executable, "-m", "loadtest.coldstart", "--child", mode],
+        cwd=run.REPO_ROOT,
+        env=os.environ.copy(),
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    parser.add_argument("--child", choices=["import", "render"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        result = measure_import() if args.child == "import" else measure_render()
+        print(json.dumps(result))
+        return
+
+    server, _ = stub_server.start(students=1)
+    run.configure_environment(
+        f"http://127.0.0.1:{server.server_port}", tempfile.mkdtemp(prefix="coldstart-")
+    )
+    samples = {}
+    for _ in range(args.repeat):
+        for mode in ("import", "render"):
+            for key, value in sample(mode).items():
+                samples.setdefault(key, []).append(value)
+    server.shutdown()
+
+    report = {
+        key: {"median": round(statistics.median(values), 3), "min": round(min(values), 3)}
+        for key, values in samples.items()
+    }
+    report["python"] = sys.version.split()[0]
+    report["repeat"] = args.repeat
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+    for key, value in report.items():
+        print(f"{key:24} {value}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""Compare time to first token with and without the local text extraction path.
+
+Sends a generated CV to the CV Reviewer and Experience Detail Discovery
+assistants through core.run_headless against the local stand-in
+(loadtest.stub_server), once as a file attachment and once inlined:
+
+    python -m loadtest.extraction_bench --repeat 5 --indexing-delay 2
+
+--indexing-delay is how long the stand-in holds the first delta while a new
+file_search attachment is indexed; set it to what production shows.
+"""
+import argparse
+import io
+import json
+import os
+import statistics
+import tempfile
+import time
+import zipfile
+
+from loadtest import run, stub_server
+
+PAGES = {
+    "CV Reviewer": ("OPENAI_ASSISTANTS_7", "Tolong review CV saya."),
+    "Experience Detail Discovery": ("OPENAI_ASSISTANTS_3", "Ini CV saya, bantu gali pengalaman saya."),
+}
+CV_LINES = [
+    "Budi Santoso - Data Analyst",
+    "Pengalaman: Data Analyst di PT Contoh (2021-2024), membangun dashboard penjualan mingguan.",
+    "Pendidikan: S1 Statistika, Universitas Contoh, IPK 3.6.",
+    "Keahlian: SQL, Python, Tableau, komunikasi dengan stakeholder bisnis.",
+    "Proyek: model prediksi churn yang menurunkan churn pelanggan 8%.",
+]
+
+
+class Upload(io.BytesIO):
+    # What core needs from a Streamlit UploadedFile.
+    def __init__(self, name, data):
+        super().__init__(data)
+        self.name = name
+        self.size = len(data)
+
+
+def docx_bytes(lines):
+    paragraphs = "".join(f"<w:p><w:r><w:t>{line}</w:t></w:r></w:p>" for line in lines)
+    document = (
+        '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main">'
+        f"<w:body>{paragraphs}</w:body></w:document>"
+    )
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as docx:
+        docx.writestr("word/document.xml", document)
+    return buffer.getvalue()
+
+
+def fixtures():
+    lines = CV_LINES * 4
+    return {
+        "cv.txt": "\n".join(lines).encode(),
+        "cv.docx": docx_bytes(lines),
+    }
+
+
+def measure(state, page, file_name, data, sample):
+    import core
+
+    env_name, prompt = PAGES[page]
+    student = f"bench-{page}-{file_name}-{sample}-{time.time_ns()}"
+    started = time.time()
+    _, run_details = core.run_headless(
+        prompt,
+        Upload(file_name, data),
+        os.environ[env_name],
+        student,
+        student,
+        student,
+        page=page,
+    )
+    return state.first_deltas[run_details.thread_id][0] - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--ttft", type=float, default=0.5, help="stand-in seconds before the first delta")
+    parser.add_argument("--indexing-delay", type=float, default=2.0)
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args()
+
+    server, state = stub_server.start(
+        students=1, ttft=args.ttft, token_delay=0.0, response_tokens=20, indexing_delay=args.indexing_delay
+    )
+    run.configure_environment(
+        f"http://127.0.0.1:{server.server_port}", tempfile.mkdtemp(prefix="extraction-")
+    )
+    os.environ.update({"OPENAI_ASSISTANTS_3": "asst_stub", "OPENAI_ASSISTANTS_7": "asst_stub"})
+    import extraction
+
+    report = {}
+    for page in PAGES:
+        for file_name, data in fixtures().items():
+            for enabled in (False, True):
+                extraction.EXTRACT_ENABLED = enabled
+                samples = [measure(state, page, file_name, data, i) for i in range(args.repeat)]
+                key = f"{page} / {file_name} / {'inline' if enabled else 'attachment'}"
+                report[key] = {
+                    "ttft_median": round(statistics.median(samples), 3),
+                    "ttft_min": round(min(samples), 3),
+                }
+    server.shutdown()
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+    for key, value in report.items():
+        print(f"{key:58} {value}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,380 @@
+"""Offline microbenchmarks for the streaming, rendering and persistence hot paths.
+
+Replays recorded Assistants stream fixtures (loadtest/fixtures) with no
+network access at all, and compares each result with a saved baseline:
+
+    python -m loadtest.microbench --save-baseline   # record this machine's baseline
+    python -m loadtest.microbench                   # compare; exit 1 on a regression
+    python -m loadtest.microbench record            # re-record the fixtures
+
+Benchmarks:
+  stream_handler_{5k,20k}     SSE events through EventHandler (SDK snapshot
+                              accumulation, on_text_delta into a RunBuffer)
+  stream_render_{5k,20k}      the page side: StreamRenderer over every delta
+  format_annotation_200       a 20k character reply with 200 annotations
+  render_chat_{window,full}   load_chat_screen with 400 messages in page_chat_logs
+  save_chat_history_{airtable,sqlite}
+                              200 turns through save_chat_history, to the
+                              spooled Airtable writer (stub table) or SQLite
+"""
+import argparse
+import gc
+import gzip
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+STREAM_FIXTURES = {"5k": 5000, "20k": 20000}
+ANNOTATIONS = 200
+CHAT_MESSAGES = 400
+HISTORY_TURNS = 200
+PAGE = "Microbenchmark"
+
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    # setup() returns the callable that is timed.
+    def register(setup):
+        BENCHMARKS[name] = setup
+        return setup
+    return register
+
+
+def configure_offline(workdir):
+    # Must run before core is imported; nothing may reach the network.
+    os.environ.update({
+        "OPENAI_API_KEY": "offline",
+        "OPENAI_BASE_URL": "http://127.0.0.1:9/v1",
+        "OPENAI_MAX_RETRIES": "0",
+        "AIRTABLE_API_KEY": "offline",
+        "AIRTABLE_ENDPOINT_URL": "http://127.0.0.1:9",
+        "BASE_ID": "appOffline",
+        "CACHE_DIR": workdir,
+        "HISTORY_FLUSH_INTERVAL": "0.05",
+        "RUN_IDLE_TIMEOUT": "0",
+    })
+    os.environ.pop("AZURE_OPENAI_ENDPOINT", None)
+
+
+def load_stream(size):
+    with gzip.open(os.path.join(FIXTURES_DIR, f"stream_{size}.jsonl.gz"), "rt") as fixture:
+        return [json.loads(line) for line in fixture]
+
+
+def parse_events(records):
+    from openai._models import construct_type
+    from openai.types.beta import AssistantStreamEvent
+
+    return [construct_type(type_=AssistantStreamEvent, value=record) for record in records]
+
+
+class NullPlaceholder:
+    def markdown(self, body, unsafe_allow_html=False):
+        pass
+
+
+def _stream_handler(size):
+    import core
+    import run_workers
+
+    events = parse_events(load_stream(size))
+
+    def replay():
+        handler = core.EventHandler(events[0].data.thread_id, run_workers.RunBuffer("bench", PAGE))
+        # The SDK's own consumption path, fed from the fixture instead of HTTP.
+        handler._init(iter(events))
+        handler.until_done()
+    return replay
+
+
+def _stream_render(size):
+    from streaming import StreamRenderer
+
+    deltas = [
+        part["text"]["value"]
+        for record in load_stream(size)
+        if record["event"] == "thread.message.delta"
+        for part in record["data"]["delta"]["content"]
+    ]
+
+    def replay():
+        # fps=0 renders on every delta: the worst case attach_run can see.
+        renderer = StreamRenderer(NullPlaceholder(), fps=0)
+        text = ""
+        for delta in deltas:
+            text += delta
+            renderer.feed(text)
+        renderer.flush()
+    return replay
+
+
+for _size in STREAM_FIXTURES:
+    benchmark(f"stream_handler_{_size}")(lambda size=_size: _stream_handler(size))
+    benchmark(f"stream_render_{_size}")(lambda size=_size: _stream_render(size))
+
+
+@benchmark(f"format_annotation_{ANNOTATIONS}")
+def _format_annotation():
+    import core
+    import file_links
+    from openai.types import FileObject
+    from openai.types.beta.threads import Text
+
+    with open(os.path.join(FIXTURES_DIR, "annotated_message.json")) as fixture:
+        text = Text.construct(**json.load(fixture))
+        text = Text.model_validate(text.model_dump())
+    # Warm the metadata cache and the generated file folder as a live
+    # session would have them after the first turn.
+    file_links.GENERATED_FILES_DIR = os.path.join(os.environ["CACHE_DIR"], "generated")
+    for annotation in text.annotations:
+        if annotation.type == "file_citation":
+            file_id = annotation.file_citation.file_id
+            file_links._metadata.set(file_id, FileObject.construct(id=file_id, filename=f"{file_id}.pdf"))
+        else:
+            directory = os.path.join(
+                file_links.GENERATED_FILES_DIR, file_links._file_key(annotation.file_path.file_id)
+            )
+            os.makedirs(directory, exist_ok=True)
+            open(os.path.join(directory, annotation.text.split("/")[-1]), "w").close()
+    return lambda: core.format_annotation(text)
+
+
+def _chat_page():
+    import core
+
+    core.load_chat_screen("asst_offline", "Microbenchmark")
+
+
+def _render_chat(full):
+    from streamlit.testing.v1 import AppTest
+
+    records = load_stream("5k")
+    reply = next(r["data"] for r in records if r["event"] == "thread.message.completed")
+    reply_text = reply["content"][0]["text"]["value"]
+    logs = []
+    for index in range(CHAT_MESSAGES // 2):
+        logs.append({"name": "user", "msg": f"Pertanyaan nomor {index} tentang pengalaman saya"})
+        logs.append({"name": "assistant", "msg": reply_text})
+    at = AppTest.from_function(_chat_page, default_timeout=120)
+    at.session_state["current_page"] = PAGE
+    at.session_state["session_id"] = "microbench"
+    at.session_state["page_thread_ids"] = {}
+    at.session_state["page_chat_logs"] = {PAGE: logs}
+    at.session_state["in_progress"] = False
+    if full:
+        at.session_state["chat_window_sizes"] = {PAGE: len(logs)}
+    at.run()
+
+    def render():
+        at.run()
+        if at.exception:
+            raise RuntimeError(at.exception[0].message)
+    return render
+
+
+benchmark("render_chat_window")(lambda: _render_chat(False))
+benchmark("render_chat_full")(lambda: _render_chat(True))
+
+
+class StubTable:
+    def __init__(self):
+        self.records = 0
+
+    def batch_create(self, records):
+        self.records += len(records)
+
+
+def _save_chat_history(store):
+    import core
+
+    core.get_history_store = lambda: store
+    reply = "Jawaban asisten " * 200
+
+    def save():
+        for index in range(HISTORY_TURNS):
+            core.save_chat_history(
+                "microbench", "student0", "S00000", f"Pesan {index}", reply,
+                "asst_offline", "gpt-4o-mini", 1200, 300, 1500,
+            )
+    return save
+
+
+@benchmark("save_chat_history_airtable")
+def _save_airtable():
+    import history
+
+    return _save_chat_history(history.AirtableHistoryStore(StubTable))
+
+
+@benchmark("save_chat_history_sqlite")
+def _save_sqlite():
+    import history
+
+    path = os.path.join(os.environ["CACHE_DIR"], "history_bench.sqlite3")
+    return _save_chat_history(history.SQLiteHistoryStore(path))
+
+
+def measure(fn, repeat):
+    fn()
+    samples = []
+    for _ in range(repeat):
+        # Like timeit: a collection in the middle of one sample is noise.
+        gc.collect()
+        gc.disable()
+        try:
+            started = time.perf_counter()
+            fn()
+            samples.append(time.perf_counter() - started)
+        finally:
+            gc.enable()
+    return {"median": statistics.median(samples), "min": min(samples)}
+
+
+def compare(results, baseline, threshold):
+    """Per benchmark: fastest run over the baseline's, and whether it regressed.
+
+    The minimum is compared because it is the least disturbed by other load
+    on the machine; medians are reported alongside.
+    """
+    report = {}
+    for name, result in results.items():
+        entry = {"median_seconds": round(result["median"], 6), "min_seconds": round(result["min"], 6)}
+        previous = baseline.get("results", {}).get(name)
+        if previous:
+            ratio = result["min"] / previous["min"]
+            entry["vs_baseline"] = round(ratio, 3)
+            entry["regression"] = ratio > 1 + threshold
+        report[name] = entry
+    return report
+
+
+def record():
+    """Record the fixtures from the local stand-in; the reply text is seeded."""
+    import httpx
+
+    from loadtest import stub_server
+
+    os.makedirs(FIXTURES_DIR, exist_ok=True)
+    server, state = stub_server.start(students=1, ttft=0, token_delay=0)
+    base_url = f"http://127.0.0.1:{server.server_port}/v1"
+    for size, chars in STREAM_FIXTURES.items():
+        random.seed(chars)
+        thread = httpx.post(f"{base_url}/threads", json={}).json()
+        httpx.post(
+            f"{base_url}/threads/{thread['id']}/messages",
+            json={"role": "user", "content": "Tolong review CV saya."},
+        )
+        # Stand-in words average about 7 characters with their space.
+        state.response_tokens = chars // 7
+        records = []
+        with httpx.stream(
+            "POST", f"{base_url}/threads/{thread['id']}/runs", json={"assistant_id": "asst_offline", "stream": True}
+        ) as response:
+            event = None
+            for line in response.iter_lines():
+                if line.startswith("event: "):
+                    event = line[len("event: "):]
+                elif line.startswith("data: ") and event and event != "done":
+                    records.append({"event": event, "data": json.loads(line[len("data: "):])})
+        with gzip.GzipFile(os.path.join(FIXTURES_DIR, f"stream_{size}.jsonl.gz"), "wb", mtime=0) as fixture:
+            fixture.write("".join(json.dumps(r, sort_keys=True) + "\n" for r in records).encode())
+        print(f"stream_{size}: {len(records)} events")
+    server.shutdown()
+
+    random.seed(ANNOTATIONS)
+    words = stub_server.WORDS
+    pieces, annotations = [], []
+    for index in range(ANNOTATIONS):
+        pieces.append(" ".join(random.choice(words) for _ in range(14)) + " ")
+        start = sum(len(piece) for piece in pieces)
+        if index % 2:
+            marker = f"【{index}:0†source】"
+            annotations.append({
+                "type": "file_citation", "text": marker, "start_index": start, "end_index": start + len(marker),
+                "file_citation": {"file_id": f"file-cite{index:04d}", "quote": " ".join(random.choice(words) for _ in range(6))},
+            })
+        else:
+            marker = f"[hasil_{index}.csv](sandbox:/mnt/data/hasil_{index}.csv)"
+            annotations.append({
+                "type": "file_path", "text": f"sandbox:/mnt/data/hasil_{index}.csv",
+                "start_index": start, "end_index": start + len(marker),
+                "file_path": {"file_id": f"file-gen{index:04d}"},
+            })
+        pieces.append(marker + "\n")
+    with open(os.path.join(FIXTURES_DIR, "annotated_message.json"), "w") as fixture:
+        json.dump({"value": "".join(pieces), "annotations": annotations}, fixture, indent=1, ensure_ascii=False)
+    print(f"annotated_message: {ANNOTATIONS} annotations")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("command", nargs="?", choices=["run", "record"], default="run")
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--only", action="append", help="benchmark name prefix (repeatable)")
+    parser.add_argument("--baseline", default=os.path.join(".cache", "microbench_baseline.json"))
+    parser.add_argument("--save-baseline", action="store_true", help="store these results as the baseline")
+    parser.add_argument("--threshold", type=float, default=0.3, help="allowed slowdown before flagging, e.g. 0.3 = 30%%")
+    parser.add_argument("--confirm", type=int, default=2, help="re-measurements of a flagged benchmark")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args()
+
+    if args.command == "record":
+        record()
+        return
+
+    baseline_path = os.path.abspath(args.baseline)
+    configure_offline(tempfile.mkdtemp(prefix="microbench-"))
+    results = {}
+    for name, setup in BENCHMARKS.items():
+        if args.only and not any(name.startswith(prefix) for prefix in args.only):
+            continue
+        results[name] = measure(setup(), args.repeat)
+
+    baseline = {}
+    if os.path.exists(baseline_path) and not args.save_baseline:
+        with open(baseline_path) as stored:
+            baseline = json.load(stored)
+    report = compare(results, baseline, args.threshold)
+    # A slowdown has to show up again before it is flagged; one noisy
+    # neighbour should not fail the run.
+    for _ in range(args.confirm):
+        flagged = [name for name, entry in report.items() if entry.get("regression")]
+        if not flagged:
+            break
+        for name in flagged:
+            again = measure(BENCHMARKS[name](), args.repeat)
+            results[name] = {
+                "median": min(results[name]["median"], again["median"]),
+                "min": min(results[name]["min"], again["min"]),
+            }
+        report = compare(results, baseline, args.threshold)
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(baseline_path), exist_ok=True)
+        with open(baseline_path, "w") as stored:
+            json.dump({"python": sys.version.split()[0], "saved_at": int(time.time()), "results": results}, stored, indent=2)
+
+    regressions = [name for name, entry in report.items() if entry.get("regression")]
+    if args.json:
+        print(json.dumps({"results": report, "regressions": regressions}, indent=2))
+    else:
+        for name, entry in report.items():
+            flag = "  REGRESSION" if entry.get("regression") else ""
+            ratio = f"  x{entry['vs_baseline']:.2f}" if "vs_baseline" in entry else ""
+            print(
+                f"{name:30} min {entry['min_seconds'] * 1000:9.2f} ms"
+                f"  median {entry['median_seconds'] * 1000:9.2f} ms{ratio}{flag}"
+            )
+        if args.save_baseline:
+            print(f"baseline saved to {baseline_path}")
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
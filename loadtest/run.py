@@ -0,0 +1,187 @@
+"""Drive simulated students through load_chat_screen and run_stream.
+
+Each student is a streamlit AppTest session on an assistant page, logged in
+and sending messages through st.chat_input, against the local stand-in
+(loadtest.stub_server) for the Assistants API and Airtable. AppTest keeps a
+process-wide Runtime, so every student runs in its own process. It needs a
+streamlit release whose AppTest can run st.navigation pages (1.45 works):
+
+    python -m loadtest.run --students 50 --turns 3
+
+Reports time to first token, end-to-end turn latency (p50/p95/p99), turn
+throughput and Chat History write throughput.
+"""
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import queue
+import tempfile
+import time
+import uuid
+
+from loadtest import stub_server
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MAIN_SCRIPT = os.path.join(REPO_ROOT, "Home.py")
+PAGE_SCRIPT = "pages_section/1_Professional_Value_Discoveries.py"
+PAGE_TITLE = "Professional Value Discoveries"
+
+
+def percentile(values, pct):
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(pct / 100 * len(ordered)) - 1)]
+
+
+def configure_environment(base_url, workdir):
+    # Must run before core (and the modules it imports) is first imported.
+    os.environ.update({
+        "OPENAI_BASE_URL": f"{base_url}/v1",
+        "OPENAI_API_KEY": "stub",
+        "AIRTABLE_ENDPOINT_URL": base_url,
+        "AIRTABLE_API_KEY": "stub",
+        "BASE_ID": "appStub",
+        "OPENAI_ASSISTANTS_1": "asst_stub",
+        "CACHE_DIR": workdir,
+        "HISTORY_FLUSH_INTERVAL": "0.5",
+    })
+    os.environ.pop("AZURE_OPENAI_ENDPOINT", None)
+
+
+def simulate_student(index, args, results):
+    from streamlit.testing.v1 import AppTest
+
+    # Each process gets its own spool so writers never pick up each other's records.
+    os.environ["CACHE_DIR"] = os.path.join(os.environ["CACHE_DIR"], f"student{index}")
+
+    # Home.py is the entrypoint, exactly as under `streamlit run Home.py`.
+    at = AppTest.from_file(MAIN_SCRIPT, default_timeout=args.timeout)
+    at.session_state["logged_in"] = True
+    at.session_state["username"] = f"student{index}"
+    at.session_state["student_id"] = f"S{index:05d}"
+    at.session_state["session_id"] = str(uuid.uuid4())
+    at.session_state["page_chat_logs"] = {}
+    at.session_state["page_thread_ids"] = {}
+    at.switch_page(PAGE_SCRIPT).run()
+
+    for turn in range(args.turns):
+        started = time.time()
+        try:
+            at.chat_input[0].set_value(f"Halo, ini pesan ke-{turn + 1} dari student{index}").run()
+            # The answer streams in a run_every fragment, which AppTest does
+            # not tick; rerun the page until the run is over, as the browser would.
+            while not at.exception and PAGE_TITLE in at.session_state["page_runs"]:
+                time.sleep(args.poll_interval)
+                at.run()
+        except Exception as e:
+            results.put({"error": f"{type(e).__name__}: {e}"})
+            break
+        finished = time.time()
+        if at.exception:
+            results.put({"error": at.exception[0].message})
+            break
+        thread_id = at.session_state["page_thread_ids"].get(PAGE_TITLE)
+        results.put({
+            "thread_id": thread_id,
+            "turn": turn,
+            "started": started,
+            "latency": finished - started,
+            "finished": finished,
+        })
+        time.sleep(args.think_time)
+
+    import history
+    writer = history.get_writer(None)
+    deadline = time.monotonic() + 30
+    while writer.depth() and time.monotonic() < deadline:
+        time.sleep(0.1)
+
+
+def wait_for_history(expected, state, timeout):
+    deadline = time.monotonic() + timeout
+    while len(state.history_writes) < expected and time.monotonic() < deadline:
+        time.sleep(0.1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--students", type=int, default=20)
+    parser.add_argument("--turns", type=int, default=3)
+    parser.add_argument("--ramp-up", type=float, default=5.0, help="seconds over which students start")
+    parser.add_argument("--think-time", type=float, default=1.0, help="seconds between a student's turns")
+    parser.add_argument("--ttft", type=float, default=0.8)
+    parser.add_argument("--token-delay", type=float, default=0.02)
+    parser.add_argument("--response-tokens", type=int, default=300)
+    parser.add_argument("--timeout", type=float, default=120.0, help="per-turn script timeout")
+    parser.add_argument("--poll-interval", type=float, default=0.5, help="seconds between reruns while a run streams")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args()
+
+    server, state = stub_server.start(
+        students=args.students,
+        ttft=args.ttft,
+        token_delay=args.token_delay,
+        response_tokens=args.response_tokens,
+    )
+    configure_environment(f"http://127.0.0.1:{server.server_port}", tempfile.mkdtemp(prefix="loadtest-"))
+
+    context = multiprocessing.get_context("spawn")
+    result_queue = context.Queue()
+    workers = []
+    started = time.time()
+    for index in range(args.students):
+        worker = context.Process(target=simulate_student, args=(index, args, result_queue))
+        worker.start()
+        workers.append(worker)
+        time.sleep(args.ramp_up / max(1, args.students))
+    results = []
+    while any(worker.is_alive() for worker in workers) or not result_queue.empty():
+        try:
+            results.append(result_queue.get(timeout=0.2))
+        except queue.Empty:
+            pass
+    for worker in workers:
+        worker.join()
+
+    turns = [result for result in results if "error" not in result]
+    elapsed = max((turn["finished"] for turn in turns), default=time.time()) - started
+    errors = [result["error"] for result in results if "error" in result]
+    for turn in turns:
+        first_deltas = state.first_deltas.get(turn["thread_id"], [])
+        if len(first_deltas) > turn["turn"]:
+            turn["ttft"] = first_deltas[turn["turn"]] - turn["started"]
+        else:
+            turn["ttft"] = float("nan")
+    wait_for_history(len(turns), state, timeout=30)
+    writes = state.history_writes
+    write_span = (writes[-1] - started) if writes else float("nan")
+
+    ttfts = [turn["ttft"] for turn in turns if not math.isnan(turn["ttft"])]
+    latencies = [turn["latency"] for turn in turns]
+    report = {
+        "students": args.students,
+        "turns": len(turns),
+        "errors": len(errors),
+        "elapsed_seconds": round(elapsed, 2),
+        "turns_per_second": round(len(turns) / elapsed, 2),
+        "ttft_seconds": {f"p{p}": round(percentile(ttfts, p), 3) for p in (50, 95, 99)},
+        "turn_latency_seconds": {f"p{p}": round(percentile(latencies, p), 3) for p in (50, 95, 99)},
+        "history_records_written": len(writes),
+        "history_writes_per_second": round(len(writes) / write_span, 2) if writes else 0,
+    }
+    server.shutdown()
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+    for key, value in report.items():
+        print(f"{key:28} {value}")
+    for error in sorted(set(errors))[:10]:
+        print(f"error: {error}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,544 @@
+"""Local stand-in for the parts of the Assistants API and Airtable the app uses.
+
+Run it on its own and point the app at it:
+
+    python -m loadtest.stub_server --port 8765
+    OPENAI_BASE_URL=http://localhost:8765/v1 AIRTABLE_ENDPOINT_URL=http://localhost:8765 \
+        OPENAI_API_KEY=stub AIRTABLE_API_KEY=stub BASE_ID=appStub streamlit run Home.py
+
+Users student0..studentN-1 (password "pass") are seeded into the Users table.
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+
+WORDS = (
+    "CV kamu sudah cukup baik tapi bagian pengalaman kerja perlu dibuat lebih "
+    "spesifik dengan hasil yang terukur seperti persentase peningkatan penjualan "
+    "atau jumlah pengguna yang kamu layani selain itu ringkasan profil sebaiknya "
+    "menonjolkan nilai utama dan tujuan karir yang relevan dengan posisi incaran"
+).split()
+
+
+def _new_id(prefix):
+    return f"{prefix}_{uuid.uuid4().hex[:24]}"
+
+
+class StubState:
+    def __init__(self, students=100, ttft=0.8, token_delay=0.02, response_tokens=300, indexing_delay=0.0):
+        self.ttft = ttft
+        # Extra wait before the first delta while a new file_search attachment is
+        # indexed into its thread's vector store, or for a file added to a vector
+        # store to finish indexing.
+        self.indexing_delay = indexing_delay
+        # (thread id, file id) of file_search attachments already indexed
+        self.indexed_files = set()
+        # vector store id -> {"store": ..., "files": {file id: (vector store file, ready at)}}
+        self.vector_stores = {}
+        self.token_delay = token_delay
+        self.response_tokens = response_tokens
+        self.lock = threading.Lock()
+        self.threads = {}
+        self.messages = {}
+        self.runs = {}
+        self.files = {}
+        # thread id -> time.time() of the first text delta of each run
+        self.first_deltas = {}
+        self.airtable = {
+            "Users": [
+                {
+                    "id": f"rec{i:014d}",
+                    "createdTime": "2024-01-01T00:00:00.000Z",
+                    "fields": {
+                        "Username": f"student{i}",
+                        "Password": "pass",
+                        "StudentID": f"S{i:05d}",
+                    },
+                }
+                for i in range(students)
+            ],
+            "Chat History": [],
+        }
+        # time.time() timestamps of every Chat History record created
+        self.history_writes = []
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    state = None
+
+    def log_message(self, format, *args):
+        pass
+
+    # -- plumbing -------------------------------------------------------
+
+    def _body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def _json_body(self):
+        body = self._body()
+        return json.loads(body) if body else {}
+
+    def _send_json(self, payload, status=200):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_bytes(self, data, content_type="application/octet-stream"):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _not_found(self):
+        self._send_json({"error": {"message": "Not found", "type": "invalid_request_error"}}, 404)
+
+    def _start_sse(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+    def _sse(self, event, data):
+        payload = f"event: {event}\ndata: {data if isinstance(data, str) else json.dumps(data)}\n\n".encode()
+        self.wfile.write(f"{len(payload):x}\r\n".encode() + payload + b"\r\n")
+        self.wfile.flush()
+
+    def _end_sse(self):
+        self._sse("done", "[DONE]")
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+    def _route(self, method):
+        url = urlparse(self.path)
+        self.query = parse_qs(url.query)
+        parts = [unquote(part) for part in url.path.strip("/").split("/")]
+        if parts[:1] == ["v1"]:
+            return self._openai(method, parts[1:])
+        if parts[:1] == ["v0"]:
+            return self._airtable(method, parts[1:])
+        self._not_found()
+
+    def do_GET(self):
+        self._route("GET")
+
+    def do_POST(self):
+        self._route("POST")
+
+    def do_DELETE(self):
+        self._route("DELETE")
+
+    # -- Assistants API ---------------------------------------------------
+
+    def _openai(self, method, parts):
+        state = self.state
+        if parts == ["threads"] and method == "POST":
+            body = self._json_body()
+            thread = {
+                "id": _new_id("thread"),
+                "object": "thread",
+                "created_at": int(time.time()),
+                "metadata": {},
+                "tool_resources": body.get("tool_resources") or {},
+            }
+            with state.lock:
+                state.threads[thread["id"]] = thread
+                state.messages[thread["id"]] = []
+            for message in body.get("messages") or []:
+                self._add_message(thread["id"], message, role=message.get("role", "user"))
+            return self._send_json(thread)
+        if parts == ["chat", "completions"] and method == "POST":
+            body = self._json_body()
+            prompt = "".join(str(message.get("content", "")) for message in body.get("messages", []))
+            time.sleep(state.ttft)
+            content = " ".join(random.choice(WORDS) for _ in range(40))
+            return self._send_json({
+                "id": _new_id("chatcmpl"),
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": body.get("model", "gpt-4o-mini"),
+                "choices": [{
+                    "index": 0,
+                    "finish_reason": "stop",
+                    "message": {"role": "assistant", "content": content},
+                }],
+                "usage": {
+                    "prompt_tokens": len(prompt) // 4,
+                    "completion_tokens": 40,
+                    "total_tokens": len(prompt) // 4 + 40,
+                },
+            })
+        if parts[:1] == ["threads"] and len(parts) >= 2:
+            thread_id = parts[1]
+            if thread_id not in state.threads:
+                return self._not_found()
+            if len(parts) == 2:
+                if method == "POST":
+                    body = self._json_body()
+                    with state.lock:
+                        if "tool_resources" in body:
+                            state.threads[thread_id]["tool_resources"] = body["tool_resources"] or {}
+                return self._send_json(state.threads[thread_id])
+            if parts[2] == "messages":
+                if method == "POST":
+                    return self._send_json(self._add_message(thread_id, self._json_body()))
+                return self._list_messages(thread_id)
+            if parts[2] == "runs":
+                return self._runs(method, thread_id, parts[3:])
+        if parts[:1] == ["files"]:
+            return self._files(method, parts[1:])
+        if parts[:1] == ["vector_stores"]:
+            return self._vector_stores(method, parts[1:])
+        if parts[:1] == ["assistants"] and len(parts) == 2 and method == "GET":
+            return self._send_json({
+                "id": parts[1],
+                "object": "assistant",
+                "created_at": 0,
+                "name": "Stub assistant",
+                "description": None,
+                "model": "gpt-4o-mini",
+                "instructions": "",
+                "tools": [],
+                "metadata": {},
+            })
+        self._not_found()
+
+    def _add_message(self, thread_id, body, role="user", run_id=None, assistant_id=None):
+        content = body.get("content", "")
+        if isinstance(content, list):
+            content = "".join(part.get("text", "") for part in content if part.get("type") == "text")
+        message = {
+            "id": _new_id("msg"),
+            "object": "thread.message",
+            "created_at": int(time.time()),
+            "thread_id": thread_id,
+            "role": role,
+            "status": "completed",
+            "content": [{"type": "text", "text": {"value": content, "annotations": []}}],
+            "attachments": body.get("attachments") or [],
+            "assistant_id": assistant_id,
+            "run_id": run_id,
+            "metadata": {},
+        }
+        with self.state.lock:
+            self.state.messages[thread_id].append(message)
+        return message
+
+    def _list_messages(self, thread_id):
+        messages = list(self.state.messages[thread_id])
+        if self.query.get("order", ["desc"])[0] == "desc":
+            messages.reverse()
+        after = self.query.get("after", [None])[0]
+        if after:
+            ids = [message["id"] for message in messages]
+            messages = messages[ids.index(after) + 1:] if after in ids else []
+        limit = int(self.query.get("limit", [20])[0])
+        data = messages[:limit]
+        self._send_json({
+            "object": "list",
+            "data": data,
+            "first_id": data[0]["id"] if data else None,
+            "last_id": data[-1]["id"] if data else None,
+            "has_more": len(messages) > limit,
+        })
+
+    def _runs(self, method, thread_id, parts):
+        state = self.state
+        if not parts and method == "POST":
+            return self._stream_run(thread_id, self._json_body())
+        run = state.runs.get(parts[0]) if parts else None
+        if run is None:
+            return self._not_found()
+        if len(parts) == 1:
+            return self._send_json(run)
+        if parts[1] == "cancel" and method == "POST":
+            with state.lock:
+                if run["status"] in ("queued", "in_progress", "requires_action"):
+                    run["status"] = "cancelling"
+            return self._send_json(run)
+        if parts[1] == "submit_tool_outputs" and method == "POST":
+            return self._stream_run(thread_id, self._json_body(), run=run)
+        self._not_found()
+
+    def _prompt_tokens(self, thread_id, truncation_strategy=None):
+        messages = self.state.messages[thread_id]
+        if truncation_strategy and truncation_strategy.get("type") == "last_messages":
+            messages = messages[-truncation_strategy["last_messages"]:]
+        return sum(len(message["content"][0]["text"]["value"]) // 4 + 5 for message in messages)
+
+    def _indexing_wait(self, thread_id):
+        # Attachments are indexed into a vector store of the thread's own, so the
+        # same file attached on another thread is indexed again.
+        state = self.state
+        with state.lock:
+            attached = {
+                (thread_id, attachment["file_id"])
+                for message in state.messages[thread_id]
+                for attachment in message.get("attachments") or []
+                if any(tool.get("type") == "file_search" for tool in attachment.get("tools") or [])
+            }
+            new = attached - state.indexed_files
+            state.indexed_files |= new
+            wait = state.indexing_delay if new else 0.0
+            vector_store_ids = state.threads[thread_id]["tool_resources"].get("file_search", {}).get(
+                "vector_store_ids", []
+            )
+            now = time.time()
+            for vector_store_id in vector_store_ids:
+                files = state.vector_stores.get(vector_store_id, {}).get("files", {})
+                for _, ready_at in files.values():
+                    wait = max(wait, ready_at - now)
+        return wait
+
+    def _stream_run(self, thread_id, body, run=None):
+        state = self.state
+        if run is None:
+            run = {
+                "id": _new_id("run"),
+                "object": "thread.run",
+                "created_at": int(time.time()),
+                "thread_id": thread_id,
+                "assistant_id": body.get("assistant_id"),
+                "status": "queued",
+                "model": body.get("model") or "gpt-4o-mini",
+                "instructions": body.get("instructions") or "",
+                "tools": [],
+                "usage": None,
+                "truncation_strategy": body.get("truncation_strategy") or {"type": "auto", "last_messages": None},
+            }
+            with state.lock:
+                state.runs[run["id"]] = run
+        self._start_sse()
+        self._sse("thread.run.created", run)
+        run["status"] = "in_progress"
+        self._sse("thread.run.in_progress", run)
+
+        time.sleep(self._indexing_wait(thread_id))
+        time.sleep(state.ttft * random.uniform(0.7, 1.3))
+        message = {
+            "id": _new_id("msg"),
+            "object": "thread.message",
+            "created_at": int(time.time()),
+            "thread_id": thread_id,
+            "role": "assistant",
+            "status": "in_progress",
+            "content": [],
+            "attachments": [],
+            "assistant_id": run["assistant_id"],
+            "run_id": run["id"],
+            "metadata": {},
+        }
+        self._sse("thread.message.created", message)
+
+        pieces = []
+        for index in range(state.response_tokens):
+            if run["status"] == "cancelling":
+                break
+            piece = random.choice(WORDS) + " "
+            pieces.append(piece)
+            if index == 0:
+                with state.lock:
+                    state.first_deltas.setdefault(thread_id, []).append(time.time())
+            self._sse("thread.message.delta", {
+                "id": message["id"],
+                "object": "thread.message.delta",
+                "delta": {"content": [{"index": 0, "type": "text", "text": {"value": piece, "annotations": []}}]},
+            })
+            time.sleep(state.token_delay)
+
+        text = "".join(pieces).strip()
+        message["status"] = "completed"
+        message["content"] = [{"type": "text", "text": {"value": text, "annotations": []}}]
+        with state.lock:
+            state.messages[thread_id].append(message)
+        self._sse("thread.message.completed", message)
+
+        prompt_tokens = self._prompt_tokens(thread_id, run.get("truncation_strategy"))
+        run["usage"] = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": len(pieces),
+            "total_tokens": prompt_tokens + len(pieces),
+        }
+        if run["status"] == "cancelling":
+            run["status"] = "cancelled"
+            self._sse("thread.run.cancelled", run)
+        else:
+            run["status"] = "completed"
+            self._sse("thread.run.completed", run)
+        self._end_sse()
+
+    def _files(self, method, parts):
+        state = self.state
+        if not parts and method == "POST":
+            body = self._body()
+            match = re.search(rb'filename="([^"]*)"', body)
+            file = {
+                "id": _new_id("file"),
+                "object": "file",
+                "bytes": len(body),
+                "created_at": int(time.time()),
+                "filename": match.group(1).decode() if match else "upload",
+                "purpose": "assistants",
+                "status": "processed",
+            }
+            with state.lock:
+                state.files[file["id"]] = (file, body)
+            return self._send_json(file)
+        if not parts or parts[0] not in state.files:
+            return self._not_found()
+        file, content = state.files[parts[0]]
+        if len(parts) == 1 and method == "DELETE":
+            with state.lock:
+                state.files.pop(parts[0], None)
+            return self._send_json({"id": file["id"], "object": "file", "deleted": True})
+        if len(parts) == 1:
+            return self._send_json(file)
+        if parts[1] == "content":
+            return self._send_bytes(content)
+        self._not_found()
+
+    def _vector_stores(self, method, parts):
+        state = self.state
+        now = time.time()
+        if not parts and method == "POST":
+            body = self._json_body()
+            store = {
+                "id": _new_id("vs"),
+                "object": "vector_store",
+                "created_at": int(now),
+                "name": body.get("name", ""),
+                "usage_bytes": 0,
+                "file_counts": {"in_progress": 0, "completed": 0, "failed": 0, "cancelled": 0, "total": 0},
+                "status": "completed",
+                "expires_after": body.get("expires_after"),
+                "expires_at": None,
+                "last_active_at": int(now),
+                "metadata": body.get("metadata") or {},
+            }
+            with state.lock:
+                state.vector_stores[store["id"]] = {"store": store, "files": {}}
+            return self._send_json(store)
+        entry = state.vector_stores.get(parts[0]) if parts else None
+        if entry is None:
+            return self._not_found()
+        if len(parts) == 1 and method == "DELETE":
+            with state.lock:
+                state.vector_stores.pop(parts[0], None)
+            return self._send_json({"id": parts[0], "object": "vector_store.deleted", "deleted": True})
+        if len(parts) == 1:
+            return self._send_json(entry["store"])
+        if parts[1] != "files":
+            return self._not_found()
+        if len(parts) == 2 and method == "POST":
+            file_id = self._json_body()["file_id"]
+            if file_id not in state.files:
+                return self._not_found()
+            store_file = {
+                "id": file_id,
+                "object": "vector_store.file",
+                "created_at": int(now),
+                "usage_bytes": state.files[file_id][0]["bytes"],
+                "vector_store_id": parts[0],
+                "status": "in_progress",
+                "last_error": None,
+            }
+            with state.lock:
+                entry["files"][file_id] = (store_file, now + state.indexing_delay)
+            return self._send_json(store_file)
+        if len(parts) != 3 or parts[2] not in entry["files"]:
+            return self._not_found()
+        if method == "DELETE":
+            with state.lock:
+                entry["files"].pop(parts[2], None)
+            return self._send_json({"id": parts[2], "object": "vector_store.file.deleted", "deleted": True})
+        store_file, ready_at = entry["files"][parts[2]]
+        if now >= ready_at:
+            store_file["status"] = "completed"
+        return self._send_json(store_file)
+
+    # -- Airtable ---------------------------------------------------------
+
+    def _airtable(self, method, parts):
+        # /v0/{base}/{table}[/listRecords]
+        if len(parts) < 2 or parts[1] not in self.state.airtable:
+            return self._not_found()
+        table = self.state.airtable[parts[1]]
+        if method == "POST" and parts[2:] != ["listRecords"]:
+            body = self._json_body()
+            created = []
+            now = time.time()
+            with self.state.lock:
+                for record in body.get("records") or [{"fields": body.get("fields", {})}]:
+                    created.append({
+                        "id": f"rec{uuid.uuid4().hex[:14]}",
+                        "createdTime": time.strftime("%Y-%m-%dT%H:%M:%S.000Z", time.gmtime()),
+                        "fields": record["fields"],
+                    })
+                table.extend(created)
+                if parts[1] == "Chat History":
+                    self.state.history_writes.extend([now] * len(created))
+            return self._send_json({"records": created} if "records" in body else created[0])
+
+        if method == "POST":
+            formula = self._json_body().get("filterByFormula", "")
+        else:
+            formula = self.query.get("filterByFormula", [""])[0]
+        records = table
+        if "LAST_MODIFIED_TIME" in formula:
+            records = []
+        else:
+            match = re.search(r"\{Username\}\s*=\s*'((?:[^'\\]|\\.)*)'", formula)
+            if match:
+                records = [r for r in table if r["fields"].get("Username") == match.group(1)]
+        self._send_json({"records": records})
+
+
+def start(port=0, **options):
+    """Start the stand-in on a background thread; returns (server, state)."""
+    state = StubState(**options)
+    handler = type("BoundStubHandler", (StubHandler,), {"state": state})
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="stub-server", daemon=True).start()
+    return server, state
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--students", type=int, default=100)
+    parser.add_argument("--ttft", type=float, default=0.8, help="seconds before the first delta")
+    parser.add_argument("--token-delay", type=float, default=0.02, help="seconds between deltas")
+    parser.add_argument("--response-tokens", type=int, default=300)
+    parser.add_argument(
+        "--indexing-delay", type=float, default=0.0, help="seconds to index a new attachment or vector store file"
+    )
+    args = parser.parse_args()
+    server, _ = start(
+        args.port,
+        students=args.students,
+        ttft=args.ttft,
+        token_delay=args.token_delay,
+        response_tokens=args.response_tokens,
+        indexing_delay=args.indexing_delay,
+    )
+    print(f"Stand-in listening on http://127.0.0.1:{server.server_port}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""Compare time to first token per page with and without per-student vector stores.
+
+Each sample is a new student who sends the same CV, as an attachment, to
+Experience Detail Discovery, Project Crafting and then the CV Reviewer
+through core.run_headless against the local stand-in (loadtest.stub_server):
+
+    python -m loadtest.vector_store_bench --repeat 5 --indexing-delay 2
+
+Without the student's vector store every page indexes the CV again; with
+it only the first page should wait for indexing.
+"""
+import argparse
+import json
+import os
+import statistics
+import tempfile
+import time
+
+from loadtest import run, stub_server
+from loadtest.extraction_bench import CV_LINES, Upload, docx_bytes
+
+PAGES = {
+    "Experience Detail Discovery": ("OPENAI_ASSISTANTS_3", "Ini CV saya, bantu gali pengalaman saya."),
+    "Project Crafting": ("OPENAI_ASSISTANTS_6", "Ini CV saya, bantu susun proyek saya."),
+    "CV Reviewer": ("OPENAI_ASSISTANTS_7", "Tolong review CV saya."),
+}
+
+
+def measure(state, page, student, data):
+    import core
+
+    env_name, prompt = PAGES[page]
+    started = time.time()
+    _, run_details = core.run_headless(
+        prompt,
+        Upload("cv.docx", data),
+        os.environ[env_name],
+        student,
+        student,
+        student,
+        page=page,
+        student_store=True,
+    )
+    return state.first_deltas[run_details.thread_id][0] - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--ttft", type=float, default=0.5, help="stand-in seconds before the first delta")
+    parser.add_argument("--indexing-delay", type=float, default=2.0)
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args()
+
+    server, state = stub_server.start(
+        students=1, ttft=args.ttft, token_delay=0.0, response_tokens=20, indexing_delay=args.indexing_delay
+    )
+    run.configure_environment(
+        f"http://127.0.0.1:{server.server_port}", tempfile.mkdtemp(prefix="vector-stores-")
+    )
+    os.environ.update({f"OPENAI_ASSISTANTS_{n}": "asst_stub" for n in (3, 6, 7)})
+    import extraction
+    import vector_stores
+
+    # The CV has to go as a file; small ones would otherwise be inlined.
+    extraction.EXTRACT_ENABLED = False
+    data = docx_bytes(CV_LINES * 4)
+    report = {}
+    for enabled in (False, True):
+        vector_stores.VECTOR_STORE_ENABLED = enabled
+        samples = {page: [] for page in PAGES}
+        for i in range(args.repeat):
+            student = f"bench-{enabled}-{i}-{time.time_ns()}"
+            for page in PAGES:
+                samples[page].append(measure(state, page, student, data))
+        for page, values in samples.items():
+            key = f"{page} / {'student vector store' if enabled else 'thread attachment'}"
+            report[key] = {
+                "ttft_median": round(statistics.median(values), 3),
+                "ttft_min": round(min(values), 3),
+            }
+    server.shutdown()
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+    for key, value in report.items():
+        print(f"{key:58} {value}")
+
+
+if __name__ == "__main__":
+    main()
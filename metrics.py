@@ -0,0 +1,234 @@
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Port for the Prometheus text endpoint (/metrics, plus /metrics.json); 0 disables it.
+METRICS_PORT = int(os.environ.get("METRICS_PORT", 0))
+METRICS_HOST = os.environ.get("METRICS_HOST", "0.0.0.0")
+# File the JSON snapshot is rewritten to every METRICS_JSON_INTERVAL seconds.
+METRICS_JSON_PATH = os.environ.get("METRICS_JSON_PATH", "")
+METRICS_JSON_INTERVAL = float(os.environ.get("METRICS_JSON_INTERVAL", 15))
+
+# Histogram upper bounds; observations named *_seconds use the first set.
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+VALUE_BUCKETS = (0.1, 0.25, 0.5, 1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 25000, 100000, 1000000)
+
+# Process-wide counters and observations shared by every Streamlit session.
+_lock = threading.Lock()
+_counters = defaultdict(float)
+_observations = {}
+_gauges = {}
+
+
+def _key(name, labels):
+    return (name, tuple(sorted(labels.items())))
+
+
+def incr(name, value=1, **labels):
+    with _lock:
+        _counters[_key(name, labels)] += value
+
+
+def _buckets(name):
+    return SECONDS_BUCKETS if name.endswith("_seconds") else VALUE_BUCKETS
+
+
+def observe(name, value, **labels):
+    buckets = _buckets(name)
+    with _lock:
+        stats = _observations.setdefault(
+            _key(name, labels),
+            {"count": 0, "sum": 0.0, "max": 0.0, "buckets": [0] * (len(buckets) + 1)},
+        )
+        stats["count"] += 1
+        stats["sum"] += value
+        stats["max"] = max(stats["max"], value)
+        stats["buckets"][bisect_left(buckets, value)] += 1
+
+
+def gauge(name, value, **labels):
+    with _lock:
+        _gauges[_key(name, labels)] = value
+
+
+def get(name, **labels):
+    with _lock:
+        return _counters.get(_key(name, labels), 0)
+
+
+def snapshot():
+    with _lock:
+        return {
+            "counters": [
+                {"name": name, "labels": dict(labels), "value": value}
+                for (name, labels), value in _counters.items()
+            ],
+            "observations": [
+                {
+                    "name": name,
+                    "labels": dict(labels),
+                    **stats,
+                    "buckets": dict(zip([*_buckets(name), "+Inf"], stats["buckets"])),
+                }
+                for (name, labels), stats in _observations.items()
+            ],
+            "gauges": [
+                {"name": name, "labels": dict(labels), "value": value}
+                for (name, labels), value in _gauges.items()
+            ],
+        }
+
+
+# External API calls made while handling the current turn. A turn starts on
+# the script thread and carries on on a run worker, so the count is handed
+# from one thread to the other (end_turn, then join_turn).
+_turn = threading.local()
+
+
+def start_turn():
+    """Count this thread's API calls from now on, as a new turn."""
+    _turn.counter = {"api_calls": 0}
+    return _turn.counter
+
+
+def join_turn(counter):
+    """Count this thread's API calls into counter (a new turn if it is None)."""
+    _turn.counter = counter if counter is not None else {"api_calls": 0}
+
+
+def end_turn():
+    """Stop counting on this thread; returns the turn's counter, or None."""
+    counter = getattr(_turn, "counter", None)
+    _turn.counter = None
+    return counter
+
+
+def count_api_call(upstream, operation):
+    incr("api_calls_total", upstream=upstream, operation=operation)
+    counter = getattr(_turn, "counter", None)
+    if counter is not None:
+        counter["api_calls"] += 1
+
+
+def turn_api_calls():
+    counter = getattr(_turn, "counter", None)
+    return counter["api_calls"] if counter is not None else 0
+
+
+def _format_labels(labels, **extra):
+    items = [*labels, *extra.items()]
+    if not items:
+        return ""
+    pairs = []
+    for key, value in items:
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{key}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+def render_prometheus():
+    """Everything recorded so far in the Prometheus text exposition format."""
+    with _lock:
+        counters = sorted(_counters.items())
+        observations = sorted(
+            (key, {**stats, "buckets": list(stats["buckets"])}) for key, stats in _observations.items()
+        )
+        gauges = sorted(_gauges.items())
+    lines = []
+    typed = set()
+
+    def declare(name, kind):
+        if name not in typed:
+            typed.add(name)
+            lines.append(f"# TYPE {name} {kind}")
+
+    for (name, labels), value in counters:
+        declare(name, "counter")
+        lines.append(f"{name}{_format_labels(labels)} {value}")
+    for (name, labels), stats in observations:
+        declare(name, "histogram")
+        cumulative = 0
+        for bound, count in zip([*_buckets(name), "+Inf"], stats["buckets"]):
+            cumulative += count
+            lines.append(f"{name}_bucket{_format_labels(labels, le=bound)} {cumulative}")
+        lines.append(f"{name}_sum{_format_labels(labels)} {stats['sum']}")
+        lines.append(f"{name}_count{_format_labels(labels)} {stats['count']}")
+    for (name, labels), value in gauges:
+        declare(name, "gauge")
+        lines.append(f"{name}{_format_labels(labels)} {value}")
+    return "\n".join(lines) + "\n"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path == "/metrics":
+            body = render_prometheus().encode()
+            content_type = "text/plain; version=0.0.4; charset=utf-8"
+        elif self.path == "/metrics.json":
+            body = json.dumps(snapshot()).encode()
+            content_type = "application/json"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def write_json(path):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    partial = f"{path}.part"
+    with open(partial, "w") as f:
+        json.dump({"time": time.time(), **snapshot()}, f)
+    os.replace(partial, path)
+
+
+def _flush_json_forever(path, interval):
+    while True:
+        time.sleep(interval)
+        try:
+            write_json(path)
+        except OSError:
+            incr("metrics_json_flush_errors_total")
+
+
+_exporters_started = False
+_exporters_lock = threading.Lock()
+
+
+def start_exporters(port=METRICS_PORT, json_path=METRICS_JSON_PATH):
+    """Start the /metrics endpoint and the JSON file flusher once per process."""
+    global _exporters_started
+    with _exporters_lock:
+        if _exporters_started:
+            return
+        _exporters_started = True
+        if port:
+            try:
+                server = ThreadingHTTPServer((METRICS_HOST, port), _MetricsHandler)
+            except OSError:
+                # Another process (e.g. a second replica on the host) owns the port.
+                incr("metrics_http_errors_total")
+            else:
+                server.daemon_threads = True
+                threading.Thread(
+                    target=server.serve_forever, name="metrics-http", daemon=True
+                ).start()
+        if json_path:
+            threading.Thread(
+                target=_flush_json_forever,
+                args=(json_path, METRICS_JSON_INTERVAL),
+                name="metrics-json",
+                daemon=True,
+            ).start()
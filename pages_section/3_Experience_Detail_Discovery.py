@@ -1,6 +1,6 @@
 import os
 import streamlit as st
-from Home import load_chat_screen, login
+from core import load_chat_screen, login
 
 # Main content
 if 'logged_in' not in st.session_state or not st.session_state['logged_in']:
@@ -1,6 +1,59 @@
 import streamlit as st
 import os
-from Home import handle_uploaded_file, run_stream, client
+import csv
+import io
+from admission import ADMISSION_PER_USER_LIMIT
+from core import attach_run, batch_events, has_active_run, run_review, show_run_warnings, start_batch_review
+
+# Batch mode: how many reviews run at once (default and upper bound of the slider).
+# Admission runs at most ADMISSION_PER_USER_LIMIT of a student's runs at once,
+# so more parallel reviews than that would only wait in its queue.
+CV_BATCH_CONCURRENCY = int(os.environ.get("CV_BATCH_CONCURRENCY", 4))
+CV_BATCH_MAX_CONCURRENCY = min(int(os.environ.get("CV_BATCH_MAX_CONCURRENCY", 16)), ADMISSION_PER_USER_LIMIT)
+# How often the page checks on a running batch
+CV_BATCH_POLL_INTERVAL = float(os.environ.get("CV_BATCH_POLL_INTERVAL", 1))
+
+
+def batch_results_csv(results):
+    output = io.StringIO()
+    writer = csv.DictWriter(
+        output, fieldnames=["File", "Status", "Tokens", "Review"], extrasaction="ignore"
+    )
+    writer.writeheader()
+    writer.writerows(results)
+    return output.getvalue()
+
+
+@st.fragment(run_every=CV_BATCH_POLL_INTERVAL)
+def batch_progress():
+    # Reruns on its own while the batch works on a background worker; the
+    # rest of the page is not run again until the batch is done.
+    reviewer_state = st.session_state.resume_reviewer_state
+    batch = reviewer_state.get('batch')
+    if batch is None:
+        return
+    events = batch_events(batch)
+    if events is None:
+        reviewer_state['batch'] = None
+        reviewer_state['batch_interrupted'] = True
+        st.rerun()
+    items = [value for kind, value in events if kind == "item"]
+    st.progress(len(items) / batch['total'], text=f"{len(items)}/{batch['total']} reviewed")
+    for item in items:
+        if item['Status'] == "done":
+            st.expander(f"✅ {item['File']}").markdown(item['Review'])
+        else:
+            st.error(f"{item['File']}: {item['Status']}")
+        for error in item['Errors']:
+            st.warning(f"{item['File']}: {error}")
+    kind, value = events[-1] if events else (None, None)
+    if kind in ("done", "error"):
+        reviewer_state['batch'] = None
+        reviewer_state['batch_results'] = value if kind == "done" else items
+        # "error": the batch stopped early (or never started, with every run worker busy).
+        reviewer_state['batch_interrupted'] = kind == "error"
+        st.rerun()
+
 
 st.title("📄 Resume Reviewer")
 st.success("Placeholder untuk cara penggunaan assistant")
@@ -12,11 +65,62 @@ current_page = "Resume Reviewer"
 if 'resume_reviewer_state' not in st.session_state:
     st.session_state.resume_reviewer_state = {
         'uploaded_file': None,
-        'review_result': None
+        'review_result': None,
+        'batch_results': None
     }
 
+mode = st.radio("Mode", ["Single", "Batch"], horizontal=True)
+
+if mode == "Batch":
+    # The batch is reviewed on a background worker, a few resumes at once;
+    # results are shown as they arrive and kept for download.
+    uploaded_files = st.file_uploader(
+        "Upload resumes", type=["pdf", "docx", "txt"], accept_multiple_files=True
+    )
+    concurrency = 1
+    if CV_BATCH_MAX_CONCURRENCY > 1:
+        concurrency = st.slider(
+            "Parallel reviews", 1, CV_BATCH_MAX_CONCURRENCY,
+            max(1, min(CV_BATCH_CONCURRENCY, CV_BATCH_MAX_CONCURRENCY)),
+        )
+
+    reviewer_state = st.session_state.resume_reviewer_state
+    if reviewer_state.get('batch') is None:
+        if uploaded_files and st.button("Submit Batch for Review"):
+            jobs = [
+                (
+                    uploaded.name,
+                    f"Tolong bantu saya review CV berikut dan berikan feedback yang komprehensif {uploaded.name}",
+                    uploaded,
+                )
+                for uploaded in uploaded_files
+            ]
+            reviewer_state['batch_results'] = None
+            reviewer_state['batch_interrupted'] = False
+            reviewer_state['batch'] = start_batch_review(jobs, os.environ.get("OPENAI_ASSISTANTS_7"), concurrency)
+    if reviewer_state.get('batch') is not None:
+        batch_progress()
+    elif reviewer_state.get('batch_interrupted'):
+        st.warning("The batch was interrupted before it finished; please submit it again.")
+
+    results = st.session_state.resume_reviewer_state.get('batch_results')
+    if results:
+        st.subheader("Batch Review Results")
+        st.dataframe(results, column_order=["File", "Status", "Tokens", "Review"])
+        st.download_button(
+            "Download results (CSV)",
+            batch_results_csv(results),
+            file_name="cv_reviews.csv",
+            mime="text/csv",
+        )
+
+elif has_active_run(st.session_state.get('current_page')):
+    # A review is still streaming (just submitted, or started before leaving
+    # the page); a fragment follows it and reruns the page when it is done.
+    attach_run(st.session_state.get('current_page'))
+
 # Check if there's a chat history for this page
-if current_page not in st.session_state.page_chat_logs or not st.session_state.page_chat_logs[current_page]:
+elif current_page not in st.session_state.page_chat_logs or not st.session_state.page_chat_logs[current_page]:
     # No chat history, display upload and submit
     uploaded_file = st.file_uploader("Upload your resume", type=["pdf", "docx", "txt"])
 
@@ -25,22 +129,15 @@ if current_page not in st.session_state.page_chat_logs or not st.session_state.p
 
         if st.button("Submit for Review"):
             with st.spinner("Analyzing the resume..."):
-                file = handle_uploaded_file(uploaded_file)
                 user_input = f"Tolong bantu saya review CV berikut dan berikan feedback yang komprehensif {uploaded_file.name}"
                 
                 # Get the assistant ID from environment variables
                 selected_assistant_id = os.environ.get("OPENAI_ASSISTANTS_7")
                 
-                # Run the conversation
-                run_stream(user_input, file, selected_assistant_id)
-
-                # Store the result in session state
-                last_message = client.beta.threads.messages.list(
-                    thread_id=st.session_state.page_thread_ids[current_page],
-                    limit=1
-                ).data[0]
-                if last_message.role == "assistant":
-                    st.session_state.resume_reviewer_state['review_result'] = last_message.content[0].text.value
+                # Run the conversation (or reuse a cached review) and store the result in session state
+                st.session_state.resume_reviewer_state['review_result'] = run_review(
+                    user_input, uploaded_file, selected_assistant_id
+                )
                 
                 # Rerun to display the result
                 st.rerun()
@@ -49,6 +146,7 @@ else:
     # Chat history exists, display the result and option to submit new CV
     st.subheader("Previous Resume Review Result:")
     st.write(st.session_state.page_chat_logs[current_page][-1]['msg'])
+    show_run_warnings(st.session_state.get('current_page'))
 
     st.subheader("Submit a New Resume")
     new_uploaded_file = st.file_uploader("Upload a new resume", type=["pdf", "docx", "txt"])
@@ -58,14 +156,13 @@ else:
 
         if st.button("Submit for Review"):
             with st.spinner("Analyzing the new resume..."):
-                file = handle_uploaded_file(new_uploaded_file)
                 user_input = f"Tolong bantu saya review CV berikut dan berikan feedback yang komprehensif {new_uploaded_file.name}"
                 
                 # Get the assistant ID from environment variables
                 selected_assistant_id = os.environ.get("OPENAI_ASSISTANTS_7")
                 
-                # Run the conversation
-                run_stream(user_input, file, selected_assistant_id)
+                # Run the conversation (or reuse a cached review)
+                run_review(user_input, new_uploaded_file, selected_assistant_id)
 
                 # Rerun to update the display
                 st.rerun()
\ No newline at end of file
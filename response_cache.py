@@ -0,0 +1,125 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+from cache import TTLCache
+import metrics
+from settings import CACHE_DIR, connect_sqlite
+
+# Opt-in: reuse a previous review when the same file is submitted again.
+RESPONSE_CACHE_ENABLED = os.environ.get("RESPONSE_CACHE_ENABLED", "false").lower() == "true"
+RESPONSE_CACHE_PATH = os.environ.get(
+    "RESPONSE_CACHE_PATH", os.path.join(CACHE_DIR, "response_cache.sqlite3")
+)
+RESPONSE_CACHE_TTL = float(os.environ.get("RESPONSE_CACHE_TTL", 7 * 24 * 3600))
+RESPONSE_CACHE_MAX_BYTES = int(os.environ.get("RESPONSE_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+# How long an assistant's configuration is trusted before it is fetched again.
+ASSISTANT_VERSION_TTL = float(os.environ.get("ASSISTANT_VERSION_TTL", 300))
+
+_assistant_versions = TTLCache(maxsize=256, ttl=ASSISTANT_VERSION_TTL)
+
+
+def assistant_version(client, assistant_id):
+    """Hash of the assistant settings that shape its answers.
+
+    Editing the model, instructions or tools in the OpenAI dashboard changes
+    the version, so reviews cached under the old settings are no longer used.
+    """
+    version = _assistant_versions.get(assistant_id)
+    if version is None:
+        metrics.count_api_call("openai", "assistants.retrieve")
+        assistant = client.beta.assistants.retrieve(assistant_id)
+        settings = assistant.model_dump(
+            include={"model", "instructions", "tools", "tool_resources", "temperature", "top_p", "response_format"}
+        )
+        version = hashlib.sha256(json.dumps(settings, sort_keys=True, default=str).encode()).hexdigest()
+        _assistant_versions.set(assistant_id, version)
+    return version
+
+
+def cache_key(assistant_id, version, file_sha256, prompt):
+    parts = [assistant_id, version, file_sha256 or "", prompt]
+    return hashlib.sha256("\0".join(parts).encode()).hexdigest()
+
+
+class ResponseCache:
+    """Finished assistant replies and their runs, keyed by cache_key().
+
+    Entries expire after RESPONSE_CACHE_TTL; the least recently used ones are
+    evicted once the stored replies exceed RESPONSE_CACHE_MAX_BYTES.
+    """
+
+    def __init__(self, path=RESPONSE_CACHE_PATH, max_bytes=RESPONSE_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn = connect_sqlite(path)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, "
+            "response TEXT NOT NULL, "
+            "run_json TEXT NOT NULL, "
+            "size INTEGER NOT NULL, "
+            "created_at REAL NOT NULL, "
+            "used_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response, run_json, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None and now - row[2] > RESPONSE_CACHE_TTL:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._conn.commit()
+                row = None
+            if row is not None:
+                self._conn.execute("UPDATE responses SET used_at = ? WHERE key = ?", (now, key))
+                self._conn.commit()
+        if row is None:
+            metrics.incr("response_cache_misses_total")
+            self._report_hit_rate()
+            return None
+        metrics.incr("response_cache_hits_total")
+        self._report_hit_rate()
+        return row[0], row[1]
+
+    def put(self, key, response, run_json):
+        now = time.time()
+        size = len(response.encode()) + len(run_json.encode())
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                (key, response, run_json, size, now, now),
+            )
+            # Keep the most recently used entries that fit in max_bytes.
+            self._conn.execute(
+                "DELETE FROM responses WHERE key IN ("
+                "SELECT key FROM ("
+                "SELECT key, SUM(size) OVER (ORDER BY used_at DESC, key) AS running FROM responses"
+                ") WHERE running > ?)",
+                (self.max_bytes,),
+            )
+            self._conn.commit()
+            stored = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        metrics.gauge("response_cache_bytes", stored)
+
+    def _report_hit_rate(self):
+        hits = metrics.get("response_cache_hits_total")
+        misses = metrics.get("response_cache_misses_total")
+        metrics.gauge("response_cache_hit_rate", hits / (hits + misses))
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResponseCache()
+        return _cache
@@ -0,0 +1,194 @@
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+from admission import ADMISSION_GLOBAL_LIMIT, ADMISSION_MAX_QUEUE
+
+# Assistant runs stream on these threads instead of the Streamlit script
+# thread, so a rerun (page switch, reconnect) does not cut them off. A turn
+# waits for admission on its worker, so there must be one for every admitted
+# and every queued turn, plus some for jobs that hold no ticket themselves
+# (CV batches). Threads are only started as they are needed.
+RUN_WORKERS = int(os.environ.get("RUN_WORKERS", ADMISSION_GLOBAL_LIMIT + ADMISSION_MAX_QUEUE + 32))
+# Finished runs stay readable this long for a student who comes back to the page.
+RUN_BUFFER_TTL = float(os.environ.get("RUN_BUFFER_TTL", 900))
+# Runs nobody has followed for this long are cancelled (0 keeps them going).
+RUN_IDLE_TIMEOUT = float(os.environ.get("RUN_IDLE_TIMEOUT", 300))
+# After a cancel, how long the run may keep streaming before its stream is closed.
+RUN_CANCEL_GRACE = float(os.environ.get("RUN_CANCEL_GRACE", 5))
+RUN_WATCH_INTERVAL = 5.0
+
+
+class RunCancelled(Exception):
+    pass
+
+
+class RunPoolFull(Exception):
+    """Every worker is taken; the job was not started."""
+
+
+class RunBuffer:
+    """Everything a run produced so far, as (kind, value) events in order.
+
+    Kinds: "queued" (admission queue position), "admitted", "thread" (the
+    turn moved to a new, summarized thread), "delta" (new reply text),
+    "message" (a finished, formatted message), "warning", "item" (one
+    review of a batch) and finally "done" (the job's result) or "error"
+    (the exception it raised).
+    Readers keep their own offset, so any number of them can replay it.
+    """
+
+    def __init__(self, owner, page, watched=True):
+        self.key = uuid.uuid4().hex
+        self.owner = owner
+        self.page = page
+        self.watched = watched
+        self.events = []
+        self.finished_at = None
+        self.last_read_at = time.monotonic()
+        self.cancel_reason = None
+        self.cancel_requested_at = None
+        self._cancel_callbacks = []
+        self._cond = threading.Condition()
+
+    @property
+    def finished(self):
+        return self.finished_at is not None
+
+    def append(self, kind, value=None):
+        with self._cond:
+            self.events.append((kind, value))
+            if kind in ("done", "error"):
+                self.finished_at = time.monotonic()
+            self._cond.notify_all()
+
+    def read(self, offset, timeout=None):
+        """Events from offset on, waiting up to timeout when there are none yet."""
+        with self._cond:
+            self.last_read_at = time.monotonic()
+            if offset >= len(self.events) and not self.finished:
+                self._cond.wait(timeout)
+            return self.events[offset:]
+
+    def cancel(self, reason):
+        """Ask the run to stop; returns False if it is already done or stopping."""
+        with self._cond:
+            if self.finished or self.cancel_reason is not None:
+                return False
+            self.cancel_reason = reason
+            self.cancel_requested_at = time.monotonic()
+            callbacks = list(self._cancel_callbacks)
+            self._cond.notify_all()
+        metrics.incr("runs_cancel_requested_total", reason=reason)
+        for callback in callbacks:
+            callback()
+        return True
+
+    def on_cancel(self, callback):
+        """Call callback from cancel(), or right away if cancel() already happened."""
+        with self._cond:
+            if self.cancel_reason is None:
+                self._cancel_callbacks.append(callback)
+                return
+        callback()
+
+    def past_cancel_grace(self):
+        return self.cancel_requested_at is not None and (
+            time.monotonic() - self.cancel_requested_at > RUN_CANCEL_GRACE
+        )
+
+
+class RunPool:
+    """Process-wide workers running jobs that report through a RunBuffer."""
+
+    def __init__(self, workers=RUN_WORKERS, buffer_ttl=RUN_BUFFER_TTL, idle_timeout=RUN_IDLE_TIMEOUT):
+        self.workers = workers
+        self.buffer_ttl = buffer_ttl
+        self.idle_timeout = idle_timeout
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="run")
+        self._buffers = {}
+        self._running = 0
+        self._pending = 0
+        self._lock = threading.Lock()
+        if idle_timeout > 0:
+            threading.Thread(target=self._watch, name="run-watchdog", daemon=True).start()
+
+    def submit(self, owner, page, fn, *args, watched=True, **kwargs):
+        """Call fn(buffer, *args, **kwargs) on a worker; returns the buffer.
+
+        Unless watched is False, the idle watchdog cancels the job once
+        nobody has read its buffer for idle_timeout.
+
+        With every worker taken the buffer ends at once with RunPoolFull,
+        rather than the job waiting unseen in the executor's queue.
+        """
+        buffer = RunBuffer(owner, page, watched)
+        with self._lock:
+            self._expire()
+            self._buffers[buffer.key] = buffer
+            metrics.gauge("run_buffers", len(self._buffers))
+            full = self._pending >= self.workers
+            if not full:
+                self._pending += 1
+        if full:
+            metrics.incr("runs_rejected_total", reason="pool_full")
+            buffer.append("error", RunPoolFull())
+            return buffer
+        metrics.incr("runs_submitted_total")
+        self._executor.submit(self._run, buffer, fn, args, kwargs)
+        return buffer
+
+    def get(self, key):
+        with self._lock:
+            return self._buffers.get(key)
+
+    def _run(self, buffer, fn, args, kwargs):
+        with self._lock:
+            self._running += 1
+            metrics.gauge("run_workers_busy", self._running)
+        try:
+            result = fn(buffer, *args, **kwargs)
+        except Exception as e:
+            buffer.append("error", e)
+        else:
+            buffer.append("done", result)
+        finally:
+            with self._lock:
+                self._running -= 1
+                self._pending -= 1
+                metrics.gauge("run_workers_busy", self._running)
+
+    def _watch(self):
+        while True:
+            time.sleep(min(RUN_WATCH_INTERVAL, self.idle_timeout))
+            now = time.monotonic()
+            with self._lock:
+                idle = [
+                    buffer
+                    for buffer in self._buffers.values()
+                    if buffer.watched and not buffer.finished and now - buffer.last_read_at > self.idle_timeout
+                ]
+            for buffer in idle:
+                buffer.cancel("idle")
+
+    def _expire(self):
+        # Caller holds self._lock.
+        now = time.monotonic()
+        for key, buffer in list(self._buffers.items()):
+            if buffer.finished and now - buffer.finished_at > self.buffer_ttl:
+                del self._buffers[key]
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = RunPool()
+        return _pool
@@ -0,0 +1,156 @@
+import json
+import os
+import threading
+import time
+
+import redis
+from redis.exceptions import RedisError  # noqa: F401 (re-exported for core)
+
+import metrics
+from settings import CACHE_DIR, connect_sqlite
+
+# "off" keeps sessions in the replica's memory only. "sqlite" (one host, e.g.
+# local testing) or "redis" let any replica, or a restarted one, continue a
+# student's session.
+SESSION_BACKEND = os.environ.get("SESSION_BACKEND", "off").lower()
+SESSION_DB_PATH = os.environ.get("SESSION_DB_PATH", os.path.join(CACHE_DIR, "sessions.sqlite3"))
+# Anything speaking the Redis protocol (Redis, Valkey, KeyDB, ...).
+SESSION_REDIS_URL = os.environ.get("SESSION_REDIS_URL", "redis://localhost:6379/0")
+SESSION_REDIS_TIMEOUT = float(os.environ.get("SESSION_REDIS_TIMEOUT", 2))
+SESSION_TTL = int(os.environ.get("SESSION_TTL", 7 * 24 * 3600))
+SESSION_KEY_PREFIX = "revou-coach:session:"
+
+# The st.session_state keys that make up a student's session.
+SESSION_KEYS = (
+    "session_binding",
+    "logged_in",
+    "username",
+    "student_id",
+    "session_id",
+    "page_thread_ids",
+    "page_chat_logs",
+    "page_chat_spilled",
+    "chat_window_sizes",
+    "used_thread_ids",
+    "page_prompt_tokens",
+    "page_truncated",
+    "page_inlined_files",
+    "page_runs",
+    "resume_reviewer_state",
+)
+
+
+def _encode(value):
+    if isinstance(value, set):
+        return {"__set__": sorted(value)}
+    raise TypeError(f"Cannot store {type(value).__name__} in the session store")
+
+
+def _decode(obj):
+    if obj.keys() == {"__set__"}:
+        return set(obj["__set__"])
+    return obj
+
+
+def dumps(state):
+    return json.dumps(
+        {key: state[key] for key in SESSION_KEYS if key in state}, default=_encode, sort_keys=True
+    )
+
+
+def loads(data):
+    return json.loads(data, object_hook=_decode)
+
+
+class SQLiteSessionStore:
+    """Sessions as JSON in a SQLite database that the replicas on one host share."""
+
+    def __init__(self, path=SESSION_DB_PATH, ttl=SESSION_TTL):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._conn = connect_sqlite(path, timeout=10)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            "token TEXT PRIMARY KEY, "
+            "data TEXT NOT NULL, "
+            "expires_at REAL NOT NULL)"
+        )
+        self._conn.execute("DELETE FROM sessions WHERE expires_at < ?", (time.time(),))
+        self._conn.commit()
+
+    def load(self, token):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT data FROM sessions WHERE token = ? AND expires_at >= ?", (token, time.time())
+            ).fetchone()
+        return row[0] if row else None
+
+    def save(self, token, data):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO sessions VALUES (?, ?, ?)", (token, data, time.time() + self.ttl)
+            )
+            self._conn.commit()
+
+    def delete(self, token):
+        with self._lock:
+            self._conn.execute("DELETE FROM sessions WHERE token = ?", (token,))
+            self._conn.commit()
+
+
+class RedisSessionStore:
+    """Sessions as JSON strings with an expiry, in Redis."""
+
+    def __init__(self, url=SESSION_REDIS_URL, ttl=SESSION_TTL, timeout=SESSION_REDIS_TIMEOUT):
+        self.ttl = ttl
+        # Thread-safe: the client checks connections out of its own pool and
+        # reconnects one the server (or a restart) dropped.
+        self._client = redis.Redis.from_url(
+            url, socket_timeout=timeout, socket_connect_timeout=timeout, decode_responses=True
+        )
+
+    def load(self, token):
+        return self._client.get(SESSION_KEY_PREFIX + token)
+
+    def save(self, token, data):
+        self._client.set(SESSION_KEY_PREFIX + token, data, ex=self.ttl)
+
+    def delete(self, token):
+        self._client.delete(SESSION_KEY_PREFIX + token)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    """The configured session store, or None when SESSION_BACKEND is off."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            if SESSION_BACKEND == "sqlite":
+                _store = SQLiteSessionStore()
+            elif SESSION_BACKEND == "redis":
+                _store = RedisSessionStore()
+            elif SESSION_BACKEND != "off":
+                raise ValueError(f"Unknown SESSION_BACKEND: {SESSION_BACKEND}")
+        return _store
+
+
+def load_state(token):
+    started = time.monotonic()
+    data = get_store().load(token)
+    metrics.observe("session_load_seconds", time.monotonic() - started, backend=SESSION_BACKEND)
+    return loads(data) if data else None
+
+
+def save_state(token, data):
+    started = time.monotonic()
+    get_store().save(token, data)
+    metrics.observe("session_save_seconds", time.monotonic() - started, backend=SESSION_BACKEND)
+    metrics.observe("session_bytes", len(data), backend=SESSION_BACKEND)
+
+
+def delete_state(token):
+    get_store().delete(token)
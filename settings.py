@@ -0,0 +1,22 @@
+"""Loads .env into the environment, plus the settings several modules share.
+
+Most modules read their settings from os.environ when they are imported,
+so entry points import this before any of them.
+"""
+import os
+import sqlite3
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Where the local SQLite databases live unless their own *_PATH says otherwise.
+CACHE_DIR = os.environ.get("CACHE_DIR", ".cache")
+
+
+def connect_sqlite(path, **kwargs):
+    """Opens path, creating its directory first, for use from any thread (behind the caller's lock)."""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    return sqlite3.connect(path, check_same_thread=False, **kwargs)
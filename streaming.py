@@ -0,0 +1,135 @@
+import os
+import re
+import time
+
+import metrics
+
+# Same pattern the original on_text_delta applied to the whole snapshot.
+LINK_PATTERN = re.compile(r"\[(.*?)\]\s*\(\s*(.*?)\s*\)")
+LINK_PLACEHOLDER = "Download Link"
+
+# Flush at most this many times per second (0 renders every delta) ...
+STREAM_RENDER_FPS = float(os.environ.get("STREAM_RENDER_FPS", 8))
+# ... unless at least this many new characters are waiting.
+STREAM_RENDER_MIN_CHARS = int(os.environ.get("STREAM_RENDER_MIN_CHARS", 400))
+
+
+def _skip_space(text, pos):
+    while pos < len(text) and text[pos].isspace():
+        pos += 1
+    return pos
+
+
+def _is_open_link(text, start):
+    # True if the "[" at text[start] did not match yet but still could once
+    # more text is appended. "." never crosses a newline, so the bracket part
+    # has to close on the same line; the "\s*" around "(" can span lines.
+    line_end = text.find("\n", start)
+    bracket_end = len(text) if line_end == -1 else line_end
+    close = text.find("]", start + 1, bracket_end)
+    while close != -1:
+        pos = _skip_space(text, close + 1)
+        if pos == len(text):
+            return True
+        if text[pos] == "(":
+            pos = _skip_space(text, pos + 1)
+            newline = text.find("\n", pos)
+            if pos == len(text) or newline == -1:
+                return True
+            # The target ran into a newline: only whitespace and ")" may follow.
+            if _skip_space(text, newline) == len(text):
+                return True
+        close = text.find("]", close + 1, bracket_end)
+    return line_end == -1
+
+
+def _first_open_link(text, start, end):
+    pos = text.find("[", start, end)
+    while pos != -1:
+        if _is_open_link(text, pos):
+            return pos
+        pos = text.find("[", pos + 1, end)
+    return None
+
+
+class StreamRenderer:
+    """Incremental, throttled version of the on_text_delta link stripping.
+
+    Only the unsettled suffix of the snapshot is run through LINK_PATTERN on
+    each flush; everything before the first link that could still change is
+    kept as already-processed text. Every flush renders exactly what
+    LINK_PATTERN.sub over the full snapshot would produce.
+    """
+
+    def __init__(self, placeholder, fps=STREAM_RENDER_FPS, min_chars=STREAM_RENDER_MIN_CHARS):
+        self.placeholder = placeholder
+        self.min_interval = 1.0 / fps if fps > 0 else 0.0
+        self.min_chars = min_chars
+        self.deltas = 0
+        self.renders = 0
+        self.text = ""
+        self._raw = ""
+        self._rendered_len = 0
+        self._settled_pos = 0
+        self._settled_text = ""
+        self._last_flush = 0.0
+
+    def feed(self, snapshot_value):
+        self.deltas += 1
+        self._raw = snapshot_value
+        if not snapshot_value:
+            return None
+        waiting = len(snapshot_value) - self._rendered_len
+        if (
+            time.monotonic() - self._last_flush >= self.min_interval
+            or waiting >= self.min_chars
+        ):
+            return self.flush()
+        return None
+
+    def flush(self):
+        if not self._raw or len(self._raw) == self._rendered_len:
+            return None
+        self.text = self._process()
+        self._rendered_len = len(self._raw)
+        self._last_flush = time.monotonic()
+        self.renders += 1
+        self.placeholder.markdown(self.text, True)
+        return self.text
+
+    def show(self):
+        """Flush, or draw the text already processed again (a fragment rerun's new placeholder)."""
+        if self.flush() is None and self.text:
+            self.placeholder.markdown(self.text, True)
+
+    def close(self):
+        metrics.incr("stream_deltas_total", self.deltas)
+        metrics.incr("stream_renders_total", self.renders)
+        if self.deltas:
+            metrics.observe("stream_renders_per_delta", self.renders / self.deltas)
+
+    def _process(self):
+        tail = self._raw[self._settled_pos:]
+        pieces = []
+        last = 0
+        settle_at = None
+        settled = ""
+        for match in LINK_PATTERN.finditer(tail):
+            if settle_at is None:
+                open_at = _first_open_link(tail, last, match.start())
+                if open_at is not None:
+                    settle_at = open_at
+                    settled = "".join(pieces) + tail[last:open_at]
+            pieces.append(tail[last:match.start()])
+            pieces.append(LINK_PLACEHOLDER)
+            last = match.end()
+        if settle_at is None:
+            open_at = _first_open_link(tail, last, len(tail))
+            settle_at = len(tail) if open_at is None else open_at
+            settled = "".join(pieces) + tail[last:settle_at]
+        pieces.append(tail[last:])
+
+        text = self._settled_text + "".join(pieces)
+        self._settled_text += settled
+        self._settled_pos += settle_at
+        return text
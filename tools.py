@@ -1,6 +1,173 @@
+import json
+import os
+import re
+import threading
+import time
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as ToolTimeoutError
+
+import metrics
+
+TOOL_TIMEOUT = float(os.environ.get("TOOL_TIMEOUT", 20))
+# Tool calls running at once, across all runs in the process.
+TOOL_MAX_WORKERS = int(os.environ.get("TOOL_MAX_WORKERS", 8))
+# Calls still running past their timeout. Beyond this, new calls fail
+# right away instead of starting yet another thread that may hang too.
+TOOL_MAX_STUCK = int(os.environ.get("TOOL_MAX_STUCK", 32))
+
+
 # example function
 def example_function(address):
     pass
 
 
-TOOL_MAP = {"example_function": example_function}
+CV_SECTION_HEADINGS = {
+    "summary": ["summary", "about me", "profile", "ringkasan", "tentang saya", "profil"],
+    "experience": ["experience", "work experience", "professional experience", "pengalaman", "pengalaman kerja"],
+    "organization": ["organization", "organizational experience", "organisasi", "pengalaman organisasi"],
+    "project": ["projects", "project experience", "proyek", "pengalaman proyek"],
+    "education": ["education", "pendidikan"],
+    "skills": ["skills", "keahlian", "kemampuan"],
+    "certification": ["certifications", "certificates", "sertifikasi"],
+}
+_HEADING_LOOKUP = {
+    heading: section
+    for section, headings in CV_SECTION_HEADINGS.items()
+    for heading in headings
+}
+
+
+def parse_cv_sections(text):
+    """Split plain CV text into its usual sections by their headings."""
+    sections = {"header": []}
+    current = "header"
+    for line in text.splitlines():
+        heading = re.sub(r"[^a-z ]", "", line.strip().lower()).strip()
+        if heading in _HEADING_LOOKUP:
+            current = _HEADING_LOOKUP[heading]
+            sections.setdefault(current, [])
+            continue
+        sections[current].append(line)
+    parsed = {}
+    for section, lines in sections.items():
+        content = "\n".join(lines).strip()
+        if content:
+            parsed[section] = content
+    return parsed
+
+
+TOOL_MAP = {
+    "example_function": example_function,
+    "parse_cv_sections": parse_cv_sections,
+}
+
+# Per-tool timeout overrides in seconds; everything else uses TOOL_TIMEOUT.
+TOOL_TIMEOUTS = {}
+
+_slots = threading.BoundedSemaphore(TOOL_MAX_WORKERS)
+_stuck_lock = threading.Lock()
+_stuck = 0
+
+
+def _error_output(message):
+    return json.dumps({"error": message})
+
+
+def _call_tool(name, arguments):
+    started = time.monotonic()
+    try:
+        output = TOOL_MAP[name](**json.loads(arguments or "{}"))
+    finally:
+        metrics.observe("tool_call_seconds", time.monotonic() - started, tool=name)
+    return output if isinstance(output, str) else json.dumps(output, default=str)
+
+
+def _count_stuck(change):
+    global _stuck
+    with _stuck_lock:
+        _stuck += change
+        stuck = _stuck
+    metrics.gauge("tool_calls_stuck", stuck)
+
+
+class _ToolCall:
+    """One tool call on its own daemon thread, holding one of the TOOL_MAX_WORKERS slots.
+
+    A call that runs past its timeout is abandoned: its slot is freed for
+    other calls and the thread counts as stuck until it ends, so a hung tool
+    never holds a shared worker.
+    """
+
+    def __init__(self, name, arguments):
+        self.future = Future()
+        self._lock = threading.Lock()
+        self._abandoned = False
+        threading.Thread(target=self._run, args=(name, arguments), name=f"tool-{name}", daemon=True).start()
+
+    def _run(self, name, arguments):
+        try:
+            self.future.set_result(_call_tool(name, arguments))
+        except Exception as e:
+            self.future.set_exception(e)
+        with self._lock:
+            abandoned = self._abandoned
+        if abandoned:
+            _count_stuck(-1)
+        else:
+            _slots.release()
+
+    def abandon(self):
+        with self._lock:
+            if self.future.done():
+                return
+            self._abandoned = True
+        _slots.release()
+        _count_stuck(1)
+
+
+def _start_call(name, arguments, deadline):
+    # None if no slot frees up before the deadline or too many calls are stuck.
+    if _stuck >= TOOL_MAX_STUCK:
+        return None
+    if not _slots.acquire(timeout=max(0, deadline - time.monotonic())):
+        return None
+    return _ToolCall(name, arguments)
+
+
+def run_tool_calls(tool_calls):
+    """Run a requires_action batch of function calls concurrently.
+
+    Returns tool_outputs ready for submit_tool_outputs. A tool that raises,
+    is unknown or runs past its timeout gets an error output instead of
+    aborting the run.
+    """
+    submitted = []
+    for tool_call in tool_calls:
+        name = tool_call.function.name
+        if name not in TOOL_MAP:
+            submitted.append((tool_call, None, 0))
+            continue
+        deadline = time.monotonic() + TOOL_TIMEOUTS.get(name, TOOL_TIMEOUT)
+        submitted.append((tool_call, _start_call(name, tool_call.function.arguments, deadline), deadline))
+
+    tool_outputs = []
+    for tool_call, call, deadline in submitted:
+        name = tool_call.function.name
+        if name not in TOOL_MAP:
+            metrics.incr("tool_call_errors_total", tool=name, reason="unknown")
+            output = _error_output(f"Unknown tool: {name}")
+        elif call is None:
+            metrics.incr("tool_call_errors_total", tool=name, reason="busy")
+            output = _error_output(f"Tool {name} is busy, try again later")
+        else:
+            try:
+                output = call.future.result(timeout=max(0, deadline - time.monotonic()))
+            except ToolTimeoutError:
+                call.abandon()
+                metrics.incr("tool_call_errors_total", tool=name, reason="timeout")
+                output = _error_output(f"Tool {name} timed out")
+            except Exception as e:
+                metrics.incr("tool_call_errors_total", tool=name, reason="exception")
+                output = _error_output(f"{type(e).__name__}: {e}")
+        tool_outputs.append({"tool_call_id": tool_call.id, "output": output})
+    return tool_outputs
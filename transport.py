@@ -0,0 +1,253 @@
+import importlib.util
+import os
+import threading
+import time
+
+import httpx
+import requests
+from pyairtable import Api
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import metrics
+
+# Connection pool shared by every session in the process, per upstream.
+HTTP_POOL_SIZE = int(os.environ.get("HTTP_POOL_SIZE", 100))
+HTTP_KEEPALIVE_CONNECTIONS = int(os.environ.get("HTTP_KEEPALIVE_CONNECTIONS", 20))
+HTTP_KEEPALIVE_EXPIRY = float(os.environ.get("HTTP_KEEPALIVE_EXPIRY", 30))
+HTTP_CONNECT_TIMEOUT = float(os.environ.get("HTTP_CONNECT_TIMEOUT", 5))
+# Longest gap between two chunks of a response (streams included).
+HTTP_READ_TIMEOUT = float(os.environ.get("HTTP_READ_TIMEOUT", 120))
+HTTP_WRITE_TIMEOUT = float(os.environ.get("HTTP_WRITE_TIMEOUT", 60))
+# Needs the h2 package (httpx[http2]); ignored when it is not installed.
+HTTP_HTTP2 = os.environ.get("HTTP_HTTP2", "false").lower() == "true"
+
+OPENAI_MAX_RETRIES = int(os.environ.get("OPENAI_MAX_RETRIES", 2))
+AIRTABLE_MAX_RETRIES = int(os.environ.get("AIRTABLE_MAX_RETRIES", 5))
+AIRTABLE_RETRY_BACKOFF = float(os.environ.get("AIRTABLE_RETRY_BACKOFF", 0.2))
+AIRTABLE_RETRY_JITTER = float(os.environ.get("AIRTABLE_RETRY_JITTER", 0.5))
+
+# Consecutive failures that open an upstream's breaker, and how long it stays open.
+BREAKER_FAILURE_THRESHOLD = int(os.environ.get("BREAKER_FAILURE_THRESHOLD", 5))
+BREAKER_RESET_TIMEOUT = float(os.environ.get("BREAKER_RESET_TIMEOUT", 30))
+
+
+class CircuitBreaker:
+    """Closed -> open after too many failures -> half-open trial after reset_timeout."""
+
+    def __init__(self, upstream, failure_threshold=BREAKER_FAILURE_THRESHOLD, reset_timeout=BREAKER_RESET_TIMEOUT):
+        self.upstream = upstream
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self._set_state("half_open")
+            if self.state == "half_open" and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+        metrics.incr("http_breaker_rejections_total", upstream=self.upstream)
+        return False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._trial_in_flight = False
+            if self.state != "closed":
+                self._set_state("closed")
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_in_flight = False
+            if self.state == "half_open" or self._failures >= self.failure_threshold:
+                if self.state != "open":
+                    metrics.incr("http_breaker_opened_total", upstream=self.upstream)
+                self._opened_at = time.monotonic()
+                self._set_state("open")
+
+    def _set_state(self, state):
+        self.state = state
+        metrics.gauge(
+            "http_breaker_open", {"closed": 0, "half_open": 0.5, "open": 1}[state], upstream=self.upstream
+        )
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(upstream):
+    with _breakers_lock:
+        if upstream not in _breakers:
+            _breakers[upstream] = CircuitBreaker(upstream)
+        return _breakers[upstream]
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class BreakerTransport(httpx.BaseTransport):
+    """httpx transport that counts requests, new connections and retries, behind a breaker."""
+
+    def __init__(self, transport, upstream):
+        self._transport = transport
+        self._upstream = upstream
+
+    def _trace(self, event_name, info):
+        if event_name == "connection.connect_tcp.complete":
+            metrics.incr("http_connections_opened_total", upstream=self._upstream)
+
+    def handle_request(self, request):
+        breaker = get_breaker(self._upstream)
+        if not breaker.allow():
+            # The OpenAI SDK retries any exception raised here, so answer with
+            # a 503 it is told not to retry instead; it raises InternalServerError.
+            return httpx.Response(
+                503,
+                headers={"x-should-retry": "false"},
+                json={"error": {"message": f"{self._upstream} circuit breaker is open", "type": "circuit_open"}},
+                request=request,
+            )
+        metrics.incr("http_requests_total", upstream=self._upstream)
+        # The OpenAI SDK numbers its own (jittered) retries in this header.
+        if request.headers.get("x-stainless-retry-count", "0") != "0":
+            metrics.incr("http_retries_total", upstream=self._upstream)
+        request.extensions = {**request.extensions, "trace": self._trace}
+        try:
+            response = self._transport.handle_request(request)
+        except httpx.TransportError:
+            breaker.record_failure()
+            metrics.incr("http_request_errors_total", upstream=self._upstream, reason="transport")
+            raise
+        if response.status_code >= 500:
+            breaker.record_failure()
+            metrics.incr("http_request_errors_total", upstream=self._upstream, reason="status")
+        else:
+            breaker.record_success()
+        return response
+
+    def close(self):
+        self._transport.close()
+
+
+_openai_http_client = None
+_openai_lock = threading.Lock()
+
+
+def openai_http_client():
+    """The httpx client every OpenAI/AzureOpenAI client in the process shares."""
+    global _openai_http_client
+    with _openai_lock:
+        if _openai_http_client is None:
+            http2 = HTTP_HTTP2 and importlib.util.find_spec("h2") is not None
+            limits = httpx.Limits(
+                max_connections=HTTP_POOL_SIZE,
+                max_keepalive_connections=HTTP_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+            )
+            _openai_http_client = httpx.Client(
+                transport=BreakerTransport(
+                    httpx.HTTPTransport(limits=limits, http2=http2), "openai"
+                ),
+                timeout=httpx.Timeout(
+                    connect=HTTP_CONNECT_TIMEOUT,
+                    read=HTTP_READ_TIMEOUT,
+                    write=HTTP_WRITE_TIMEOUT,
+                    pool=HTTP_CONNECT_TIMEOUT,
+                ),
+                follow_redirects=True,
+            )
+        return _openai_http_client
+
+
+class _CountingRetry(Retry):
+    def increment(self, *args, **kwargs):
+        # Raises MaxRetryError instead of returning once retries are exhausted.
+        retry = super().increment(*args, **kwargs)
+        metrics.incr("http_retries_total", upstream="airtable")
+        return retry
+
+
+class BreakerAdapter(HTTPAdapter):
+    """requests adapter for Airtable with the same accounting and breaker as BreakerTransport."""
+
+    def __init__(self, upstream, **kwargs):
+        self._upstream = upstream
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        breaker = get_breaker(self._upstream)
+        if not breaker.allow():
+            raise CircuitOpenError(f"{self._upstream} circuit breaker is open")
+        metrics.incr("http_requests_total", upstream=self._upstream)
+        try:
+            response = super().send(request, **kwargs)
+        except requests.RequestException:
+            breaker.record_failure()
+            metrics.incr("http_request_errors_total", upstream=self._upstream, reason="transport")
+            raise
+        if response.status_code >= 500:
+            breaker.record_failure()
+            metrics.incr("http_request_errors_total", upstream=self._upstream, reason="status")
+        else:
+            breaker.record_success()
+        self._report_connections()
+        return response
+
+    def _report_connections(self):
+        # urllib3 counts the connections each host pool has opened.
+        pools = self.poolmanager.pools
+        opened = 0
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is not None:
+                opened += pool.num_connections
+        metrics.gauge("http_connections_opened", opened, upstream=self._upstream)
+
+
+_airtable_apis = {}
+_airtable_lock = threading.Lock()
+
+
+def airtable_api(api_key, endpoint_url):
+    """A pyairtable Api per key and endpoint, kept for the life of the process."""
+    with _airtable_lock:
+        api = _airtable_apis.get((api_key, endpoint_url))
+        if api is None:
+            retry = _CountingRetry(
+                total=AIRTABLE_MAX_RETRIES,
+                backoff_factor=AIRTABLE_RETRY_BACKOFF,
+                backoff_jitter=AIRTABLE_RETRY_JITTER,
+                # Read errors and 429/503 are retried for idempotent methods only
+                # (urllib3's default); a create that timed out may have been
+                # written, and HistoryWriter retries creates itself. Connect
+                # errors are retried for every method, as nothing was sent.
+                status_forcelist=(429, 503),
+                other=0,
+            )
+            api = Api(
+                api_key,
+                timeout=(HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT),
+                retry_strategy=retry,
+                endpoint_url=endpoint_url,
+            )
+            adapter = BreakerAdapter(
+                "airtable",
+                pool_connections=HTTP_KEEPALIVE_CONNECTIONS,
+                pool_maxsize=HTTP_POOL_SIZE,
+                max_retries=retry,
+            )
+            api.session.mount("https://", adapter)
+            api.session.mount("http://", adapter)
+            _airtable_apis[(api_key, endpoint_url)] = api
+        return api
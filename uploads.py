@@ -0,0 +1,151 @@
+import hashlib
+import os
+import threading
+import time
+
+from openai import NotFoundError
+from openai.types import FileObject
+
+import metrics
+from settings import CACHE_DIR, connect_sqlite
+
+UPLOAD_CACHE_PATH = os.environ.get(
+    "UPLOAD_CACHE_PATH", os.path.join(CACHE_DIR, "upload_cache.sqlite3")
+)
+UPLOAD_CACHE_TTL = float(os.environ.get("UPLOAD_CACHE_TTL", 7 * 24 * 3600))
+UPLOAD_CACHE_MAX_ENTRIES = int(os.environ.get("UPLOAD_CACHE_MAX_ENTRIES", 5000))
+# How long a remote file is trusted to exist before it is checked again.
+UPLOAD_CACHE_VERIFY_INTERVAL = float(os.environ.get("UPLOAD_CACHE_VERIFY_INTERVAL", 600))
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def content_hash(uploaded_file):
+    digest = hashlib.sha256()
+    buffer = uploaded_file.getbuffer()
+    for start in range(0, len(buffer), HASH_CHUNK_SIZE):
+        digest.update(buffer[start:start + HASH_CHUNK_SIZE])
+    return digest.hexdigest()
+
+
+class UploadCache:
+    """Maps (owner, SHA-256 of the upload) to the OpenAI file it was uploaded as.
+
+    Entries expire after UPLOAD_CACHE_TTL and the least recently used ones
+    are evicted beyond UPLOAD_CACHE_MAX_ENTRIES. The remote file is checked
+    with files.retrieve at most once per UPLOAD_CACHE_VERIFY_INTERVAL.
+    """
+
+    def __init__(self, path=UPLOAD_CACHE_PATH):
+        self._lock = threading.Lock()
+        self._conn = connect_sqlite(path)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS uploads ("
+            "owner TEXT NOT NULL, "
+            "sha256 TEXT NOT NULL, "
+            "file_json TEXT NOT NULL, "
+            "created_at REAL NOT NULL, "
+            "verified_at REAL NOT NULL, "
+            "used_at REAL NOT NULL, "
+            "PRIMARY KEY (owner, sha256))"
+        )
+        self._conn.commit()
+
+    def get(self, owner, sha256):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT file_json, created_at, verified_at FROM uploads "
+                "WHERE owner = ? AND sha256 = ?",
+                (owner, sha256),
+            ).fetchone()
+            if row is None:
+                return None
+            if now - row[1] > UPLOAD_CACHE_TTL:
+                self._delete(owner, sha256)
+                return None
+            self._conn.execute(
+                "UPDATE uploads SET used_at = ? WHERE owner = ? AND sha256 = ?",
+                (now, owner, sha256),
+            )
+            self._conn.commit()
+        return row[0], now - row[2] > UPLOAD_CACHE_VERIFY_INTERVAL
+
+    def put(self, owner, sha256, file_json):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO uploads VALUES (?, ?, ?, ?, ?, ?)",
+                (owner, sha256, file_json, now, now, now),
+            )
+            self._conn.execute(
+                "DELETE FROM uploads WHERE rowid IN ("
+                "SELECT rowid FROM uploads ORDER BY used_at DESC LIMIT -1 OFFSET ?)",
+                (UPLOAD_CACHE_MAX_ENTRIES,),
+            )
+            self._conn.commit()
+
+    def mark_verified(self, owner, sha256):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE uploads SET verified_at = ? WHERE owner = ? AND sha256 = ?",
+                (time.time(), owner, sha256),
+            )
+            self._conn.commit()
+
+    def discard(self, owner, sha256):
+        with self._lock:
+            self._delete(owner, sha256)
+
+    def _delete(self, owner, sha256):
+        self._conn.execute(
+            "DELETE FROM uploads WHERE owner = ? AND sha256 = ?", (owner, sha256)
+        )
+        self._conn.commit()
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = UploadCache()
+        return _cache
+
+
+def upload_file(client, uploaded_file, owner, sha256=None):
+    """Return the OpenAI file for uploaded_file, uploading it only once per owner.
+
+    sha256 is content_hash(uploaded_file), if the caller already has it.
+    """
+    cache = get_cache()
+    if sha256 is None:
+        sha256 = content_hash(uploaded_file)
+    cached = cache.get(owner, sha256)
+    if cached is not None:
+        file_json, needs_verify = cached
+        file = FileObject.model_validate_json(file_json)
+        if not needs_verify:
+            metrics.incr("upload_cache_hits_total")
+            return file
+        try:
+            metrics.count_api_call("openai", "files.retrieve")
+            file = client.files.retrieve(file.id)
+            cache.mark_verified(owner, sha256)
+            metrics.incr("upload_cache_hits_total")
+            return file
+        except NotFoundError:
+            cache.discard(owner, sha256)
+            metrics.incr("upload_cache_stale_total")
+
+    metrics.incr("upload_cache_misses_total")
+    uploaded_file.seek(0)
+    started = time.monotonic()
+    metrics.count_api_call("openai", "files.create")
+    file = client.files.create(file=uploaded_file, purpose="assistants")
+    metrics.observe("upload_seconds", time.monotonic() - started)
+    cache.put(owner, sha256, file.model_dump_json())
+    return file
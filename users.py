@@ -0,0 +1,119 @@
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+from pyairtable.formulas import match
+
+import metrics
+
+# Incremental refresh interval and full reload interval (catches deletions).
+USERS_INDEX_TTL = float(os.environ.get("USERS_INDEX_TTL", 300))
+USERS_INDEX_FULL_RELOAD = float(os.environ.get("USERS_INDEX_FULL_RELOAD", 3600))
+# Overlap between refresh windows to absorb clock skew with Airtable.
+USERS_INDEX_OVERLAP = 60
+
+
+class UserDirectory:
+    """Process-wide index of the Users table keyed by Username."""
+
+    def __init__(self, table_factory):
+        self._table_factory = table_factory
+        self._users = {}
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._loaded_at = 0.0
+        self._refreshed_at = 0.0
+
+    def get(self, username):
+        if not username:
+            return None
+        self._maybe_refresh()
+        with self._lock:
+            record = self._users.get(username)
+        if record is not None:
+            metrics.incr("users_index_hits_total")
+            return record
+        metrics.incr("users_index_misses_total")
+        return self.refresh(username)
+
+    def refresh(self, username):
+        """Fetch username's record now and update the index with it.
+
+        For checks that must not trust a copy up to USERS_INDEX_TTL old, such
+        as a login right after the password was changed or revoked.
+        """
+        if not username:
+            return None
+        records = self._table_factory().all(
+            formula=match({"Username": username}), max_records=1
+        )
+        with self._lock:
+            if records:
+                self._users[username] = records[0]
+            else:
+                self._users.pop(username, None)
+            metrics.gauge("users_index_size", len(self._users))
+        metrics.incr("users_index_refreshes_total")
+        return records[0] if records else None
+
+    def _maybe_refresh(self):
+        now = time.time()
+        if now - self._refreshed_at < USERS_INDEX_TTL:
+            return
+        # Only one session refreshes; the others keep serving the current index.
+        if not self._refresh_lock.acquire(blocking=not self._users):
+            return
+        try:
+            if now - self._refreshed_at < USERS_INDEX_TTL:
+                return
+            if now - self._loaded_at >= USERS_INDEX_FULL_RELOAD:
+                self._load_all(now)
+            else:
+                self._load_changed(now)
+        finally:
+            self._refresh_lock.release()
+
+    def _load_all(self, now):
+        records = self._table_factory().all()
+        users = {}
+        for record in records:
+            username = record["fields"].get("Username")
+            if username:
+                users[username] = record
+        with self._lock:
+            self._users = users
+        self._loaded_at = self._refreshed_at = now
+        metrics.incr("users_index_full_loads_total")
+        metrics.gauge("users_index_size", len(users))
+
+    def _load_changed(self, now):
+        since = datetime.fromtimestamp(
+            self._refreshed_at - USERS_INDEX_OVERLAP, tz=timezone.utc
+        ).strftime("%Y-%m-%dT%H:%M:%S.000Z")
+        records = self._table_factory().all(
+            formula=f"IS_AFTER(LAST_MODIFIED_TIME(), DATETIME_PARSE('{since}'))"
+        )
+        self._store(records)
+        self._refreshed_at = now
+        metrics.incr("users_index_incremental_loads_total")
+
+    def _store(self, records):
+        with self._lock:
+            for record in records:
+                username = record["fields"].get("Username")
+                if username:
+                    self._users[username] = record
+            metrics.gauge("users_index_size", len(self._users))
+
+
+_directory = None
+_directory_lock = threading.Lock()
+
+
+def get_directory(table_factory):
+    global _directory
+    with _directory_lock:
+        if _directory is None:
+            _directory = UserDirectory(table_factory)
+        return _directory
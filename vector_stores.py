@@ -0,0 +1,252 @@
+import os
+import threading
+import time
+import zlib
+
+import openai
+
+import metrics
+from settings import CACHE_DIR, connect_sqlite
+from cache import TTLCache
+
+# Each student (by StudentID) gets one vector store holding every file they
+# upload. Threads search it through tool_resources, so a CV sent on several
+# pages is indexed once instead of once per thread.
+VECTOR_STORE_ENABLED = os.environ.get("VECTOR_STORE_ENABLED", "true").lower() == "true"
+# Replicas must share this file, or each would create its own store per student.
+VECTOR_STORE_DB_PATH = os.environ.get(
+    "VECTOR_STORE_DB_PATH", os.path.join(CACHE_DIR, "vector_stores.sqlite3")
+)
+# OpenAI drops a store (and bills nothing more for it) after this many idle days.
+VECTOR_STORE_EXPIRY_DAYS = int(os.environ.get("VECTOR_STORE_EXPIRY_DAYS", 7))
+# Least recently used files are removed from the store beyond these limits.
+VECTOR_STORE_MAX_FILES = int(os.environ.get("VECTOR_STORE_MAX_FILES", 20))
+VECTOR_STORE_MAX_BYTES = int(os.environ.get("VECTOR_STORE_MAX_BYTES", 50 * 1024 * 1024))
+# How long a store is trusted to exist (not expired) before it is checked again.
+VECTOR_STORE_VERIFY_INTERVAL = float(os.environ.get("VECTOR_STORE_VERIFY_INTERVAL", 600))
+VECTOR_STORE_POLL_INTERVAL = float(os.environ.get("VECTOR_STORE_POLL_INTERVAL", 0.5))
+
+
+class VectorStoreRegistry:
+    """Maps a student to their vector store and the files already indexed in it."""
+
+    def __init__(self, path=VECTOR_STORE_DB_PATH):
+        self._lock = threading.Lock()
+        self._conn = connect_sqlite(path, timeout=10)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS stores ("
+            "student_id TEXT PRIMARY KEY, "
+            "vector_store_id TEXT NOT NULL, "
+            "verified_at REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            "student_id TEXT NOT NULL, "
+            "file_id TEXT NOT NULL, "
+            "bytes INTEGER NOT NULL, "
+            "used_at REAL NOT NULL, "
+            "PRIMARY KEY (student_id, file_id))"
+        )
+        self._conn.commit()
+
+    def get(self, student_id):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT vector_store_id, verified_at FROM stores WHERE student_id = ?", (student_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        return row[0], time.time() - row[1] > VECTOR_STORE_VERIFY_INTERVAL
+
+    def claim(self, student_id, vector_store_id):
+        """Register vector_store_id unless the student already has a store; returns the one that won.
+
+        Replicas share this file, so two of them may create a store for the
+        same student at once: the first row written wins.
+        """
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT OR IGNORE INTO stores VALUES (?, ?, ?)", (student_id, vector_store_id, time.time())
+            )
+            if cursor.rowcount:
+                # A new store starts out empty.
+                self._conn.execute("DELETE FROM files WHERE student_id = ?", (student_id,))
+            self._conn.commit()
+            return self._conn.execute(
+                "SELECT vector_store_id FROM stores WHERE student_id = ?", (student_id,)
+            ).fetchone()[0]
+
+    def mark_verified(self, student_id):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE stores SET verified_at = ? WHERE student_id = ?", (time.time(), student_id)
+            )
+            self._conn.commit()
+
+    def discard(self, student_id, vector_store_id):
+        # Only if it is still vector_store_id; another replica may already have replaced it.
+        with self._lock:
+            cursor = self._conn.execute(
+                "DELETE FROM stores WHERE student_id = ? AND vector_store_id = ?", (student_id, vector_store_id)
+            )
+            if cursor.rowcount:
+                self._conn.execute("DELETE FROM files WHERE student_id = ?", (student_id,))
+            self._conn.commit()
+
+    def touch_file(self, student_id, file_id):
+        """Mark file_id as used; returns False if it is not in the student's store."""
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE files SET used_at = ? WHERE student_id = ? AND file_id = ?",
+                (time.time(), student_id, file_id),
+            )
+            self._conn.commit()
+        return cursor.rowcount > 0
+
+    def files(self, student_id):
+        """(file_id, bytes) of the student's files, least recently used first."""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT file_id, bytes FROM files WHERE student_id = ? ORDER BY used_at",
+                (student_id,),
+            ).fetchall()
+
+    def add_file(self, student_id, file_id, size):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)", (student_id, file_id, size, time.time())
+            )
+            self._conn.commit()
+
+    def remove_file(self, student_id, file_id):
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM files WHERE student_id = ? AND file_id = ?", (student_id, file_id)
+            )
+            self._conn.commit()
+
+
+_registry = None
+_registry_lock = threading.Lock()
+# One student's files are added one at a time, so two pages uploading at
+# once do not create two stores or index the same file twice. Students share
+# a fixed set of locks by hash, so there is nothing to clean up.
+_student_locks = [threading.Lock() for _ in range(64)]
+# Threads already pointed at their student's store, by thread id.
+_linked_threads = TTLCache(maxsize=10000, ttl=24 * 3600)
+
+
+def get_registry():
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = VectorStoreRegistry()
+        return _registry
+
+
+def _student_lock(student_id):
+    return _student_locks[zlib.crc32(student_id.encode()) % len(_student_locks)]
+
+
+def tool_resources(vector_store_id):
+    return {"file_search": {"vector_store_ids": [vector_store_id]}}
+
+
+def student_store(client, student_id, create=False):
+    """The student's vector store id; None if they have none and create is False."""
+    if not VECTOR_STORE_ENABLED or not student_id:
+        return None
+    student_id = str(student_id)
+    registry = get_registry()
+    entry = registry.get(student_id)
+    if entry is not None:
+        vector_store_id, needs_verify = entry
+        if not needs_verify:
+            return vector_store_id
+        try:
+            metrics.count_api_call("openai", "vector_stores.retrieve")
+            store = client.beta.vector_stores.retrieve(vector_store_id)
+        except openai.NotFoundError:
+            store = None
+        if store is not None and store.status != "expired":
+            registry.mark_verified(student_id)
+            return vector_store_id
+        registry.discard(student_id, vector_store_id)
+        metrics.incr("vector_stores_expired_total")
+    if not create:
+        return None
+    metrics.count_api_call("openai", "vector_stores.create")
+    store = client.beta.vector_stores.create(
+        name=f"student-{student_id}",
+        expires_after={"anchor": "last_active_at", "days": VECTOR_STORE_EXPIRY_DAYS},
+        metadata={"student_id": student_id},
+    )
+    metrics.incr("vector_stores_created_total")
+    vector_store_id = registry.claim(student_id, store.id)
+    if vector_store_id != store.id:
+        # Another replica registered one first; use theirs and drop ours.
+        metrics.incr("vector_stores_duplicate_total")
+        try:
+            metrics.count_api_call("openai", "vector_stores.delete")
+            client.beta.vector_stores.delete(store.id)
+        except openai.APIError:
+            pass
+    return vector_store_id
+
+
+def _make_room(client, student_id, vector_store_id, size):
+    registry = get_registry()
+    files = registry.files(student_id)
+    total = sum(file_bytes for _, file_bytes in files)
+    while files and (len(files) >= VECTOR_STORE_MAX_FILES or total + size > VECTOR_STORE_MAX_BYTES):
+        file_id, file_bytes = files.pop(0)
+        try:
+            metrics.count_api_call("openai", "vector_stores.files.delete")
+            client.beta.vector_stores.files.delete(file_id, vector_store_id=vector_store_id)
+        except openai.NotFoundError:
+            pass
+        registry.remove_file(student_id, file_id)
+        total -= file_bytes
+        metrics.incr("vector_store_evictions_total")
+
+
+def add_file(client, student_id, file):
+    """Index file in the student's store once; returns the store id, or None if it is not there."""
+    if not VECTOR_STORE_ENABLED or not student_id or (file.bytes or 0) > VECTOR_STORE_MAX_BYTES:
+        return None
+    student_id = str(student_id)
+    registry = get_registry()
+    with _student_lock(student_id):
+        vector_store_id = student_store(client, student_id, create=True)
+        if registry.touch_file(student_id, file.id):
+            metrics.incr("vector_store_hits_total")
+            return vector_store_id
+        metrics.incr("vector_store_misses_total")
+        _make_room(client, student_id, vector_store_id, file.bytes or 0)
+        started = time.monotonic()
+        metrics.count_api_call("openai", "vector_stores.files.create")
+        store_file = client.beta.vector_stores.files.create_and_poll(
+            file.id,
+            vector_store_id=vector_store_id,
+            poll_interval_ms=int(VECTOR_STORE_POLL_INTERVAL * 1000),
+        )
+        metrics.observe("vector_store_index_seconds", time.monotonic() - started)
+        if store_file.status != "completed":
+            metrics.incr("vector_store_index_failures_total", status=store_file.status)
+            return None
+        registry.add_file(student_id, file.id, file.bytes or 0)
+    return vector_store_id
+
+
+def link_thread(client, thread_id, vector_store_id):
+    """Point thread_id's file_search at vector_store_id, unless it already is."""
+    if _linked_threads.get(thread_id) == vector_store_id:
+        return
+    metrics.count_api_call("openai", "threads.update")
+    client.beta.threads.update(thread_id, tool_resources=tool_resources(vector_store_id))
+    _linked_threads.set(thread_id, vector_store_id)
+
+
+def mark_linked(thread_id, vector_store_id):
+    _linked_threads.set(thread_id, vector_store_id)